@@ -0,0 +1,168 @@
+"""
+Per-worker background work queue for work the response doesn't depend on.
+
+Jobs are sharded over BACKGROUND_LANES threads by key (username), so jobs
+for one player run in submission order. Failed jobs are retried in place
+with exponential backoff (which also keeps the order). When a lane is full,
+a job whose key has nothing queued runs inline in the request; otherwise
+submit blocks for up to BACKGROUND_SUBMIT_TIMEOUT_SECONDS so it can't
+overtake the key's earlier jobs. wait() lets a request wait for its
+player's queued jobs. On shutdown the lanes are drained for up to
+BACKGROUND_DRAIN_SECONDS.
+
+BACKGROUND_LANES=0 runs every job inline (old behaviour).
+"""
+import logging
+import os
+import queue
+import threading
+import time
+import zlib
+from typing import Callable
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+BACKGROUND_LANES = int(os.getenv("BACKGROUND_LANES", "4"))
+BACKGROUND_QUEUE_SIZE = int(os.getenv("BACKGROUND_QUEUE_SIZE", "1000"))  # per lane
+BACKGROUND_MAX_RETRIES = int(os.getenv("BACKGROUND_MAX_RETRIES", "3"))
+BACKGROUND_DRAIN_SECONDS = float(os.getenv("BACKGROUND_DRAIN_SECONDS", "10"))
+BACKGROUND_SUBMIT_TIMEOUT_SECONDS = float(os.getenv("BACKGROUND_SUBMIT_TIMEOUT_SECONDS", "5"))
+
+QUEUE_DEPTH = metrics.Gauge("background_queue_depth", "Jobs waiting in the background queue")
+JOB_LAG = metrics.Histogram("background_job_lag_seconds", "Time from submit to job start", ["job"])
+JOB_DURATION = metrics.Histogram("background_job_duration_seconds", "Background job run time", ["job"])
+JOBS = metrics.Counter("background_jobs_total", "Background jobs by outcome", ["job", "result"])
+
+_STOP = object()
+
+
+class BackgroundQueue:
+    def __init__(self, lanes: int, queue_size: int):
+        self.lanes = [queue.Queue(maxsize=queue_size) for _ in range(lanes)]
+        self._threads = []
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._pending = {}  # key -> jobs queued or running
+        self._idle = threading.Condition()
+        QUEUE_DEPTH.set_function(lambda: sum(lane.qsize() for lane in self.lanes))
+
+    def _ensure_started(self):
+        # Threads don't survive gunicorn's fork: start them in each worker
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._threads = [
+                threading.Thread(target=self._run, args=(lane,), name=f"background-{i}", daemon=True)
+                for i, lane in enumerate(self.lanes)
+            ]
+            for thread in self._threads:
+                thread.start()
+            self._pid = os.getpid()
+
+    def submit(self, key: str, name: str, fn: Callable, *args):
+        """Run fn(*args) after the response; jobs with the same key run in order"""
+        if not self.lanes:
+            self._run_job(name, fn, args, time.monotonic())
+            return
+        self._ensure_started()
+        lane = self.lanes[zlib.crc32(key.encode()) % len(self.lanes)]
+        with self._idle:
+            queued = self._pending.get(key, 0)
+            self._pending[key] = queued + 1
+        job = (key, name, fn, args, time.monotonic())
+        try:
+            lane.put_nowait(job)
+            return
+        except queue.Full:
+            pass
+        if queued:
+            # Running inline now would overtake the key's queued jobs: wait for room
+            try:
+                lane.put(job, timeout=BACKGROUND_SUBMIT_TIMEOUT_SECONDS)
+                return
+            except queue.Full:
+                logger.warning("Background lane stuck for %.0fs, running %s inline out of order",
+                               BACKGROUND_SUBMIT_TIMEOUT_SECONDS, name)
+        JOBS.inc(job=name, result="inline")
+        try:
+            self._run_job(name, fn, args, time.monotonic())
+        finally:
+            self._done(key)
+
+    def wait(self, key: str, timeout: float) -> bool:
+        """Wait until the key's queued jobs have run; False on timeout"""
+        with self._idle:
+            return self._idle.wait_for(lambda: key not in self._pending, timeout)
+
+    def _done(self, key: str):
+        with self._idle:
+            self._pending[key] -= 1
+            if not self._pending[key]:
+                del self._pending[key]
+                self._idle.notify_all()
+
+    def _run(self, lane: queue.Queue):
+        while True:
+            job = lane.get()
+            try:
+                if job is _STOP:
+                    return
+                key, *rest = job
+                try:
+                    self._run_job(*rest)
+                finally:
+                    self._done(key)
+            finally:
+                lane.task_done()
+
+    def _run_job(self, name: str, fn: Callable, args: tuple, submitted_at: float):
+        JOB_LAG.observe(time.monotonic() - submitted_at, job=name)
+        for attempt in range(BACKGROUND_MAX_RETRIES + 1):
+            started = time.perf_counter()
+            try:
+                fn(*args)
+                JOBS.inc(job=name, result="ok")
+                return
+            except Exception as e:
+                if attempt == BACKGROUND_MAX_RETRIES:
+                    JOBS.inc(job=name, result="failed")
+                    logger.error("Background job %s failed after %d attempts: %s", name, attempt + 1, e)
+                    return
+                JOBS.inc(job=name, result="retry")
+                logger.warning("Background job %s failed (attempt %d), retrying: %s", name, attempt + 1, e)
+                time.sleep(0.1 * 2 ** attempt)
+            finally:
+                JOB_DURATION.observe(time.perf_counter() - started, job=name)
+
+    def drain(self, timeout: float = BACKGROUND_DRAIN_SECONDS):
+        """Finish queued jobs and stop the lane threads"""
+        if self._pid != os.getpid():
+            return
+        deadline = time.monotonic() + timeout
+        for lane in self.lanes:
+            lane.put(_STOP)
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        left = sum(lane.qsize() for lane in self.lanes)
+        if left:
+            logger.warning("Background queue drain timed out, %d jobs dropped", left)
+        self._pid = None
+
+
+background_queue = BackgroundQueue(BACKGROUND_LANES, BACKGROUND_QUEUE_SIZE)
+
+
+def submit(key: str, name: str, fn: Callable, *args):
+    background_queue.submit(key, name, fn, *args)
+
+
+def wait(key: str, timeout: float = BACKGROUND_SUBMIT_TIMEOUT_SECONDS) -> bool:
+    return background_queue.wait(key, timeout)
+
+
+def drain():
+    background_queue.drain()
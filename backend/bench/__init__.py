@@ -0,0 +1 @@
+"""Benchmark harness: mock LLM server, data seeding, load scenarios"""
@@ -0,0 +1,167 @@
+"""
+Local OpenAI-compatible mock server for load tests (no DeepSeek credits).
+
+Point the backend at it:
+    python -m bench.mock_llm --port 9100 --latency lognormal:-0.5,0.4
+    DEEPSEEK_BASE_URL=http://127.0.0.1:9100/v1 DEEPSEEK_API_KEY=bench uvicorn main:app
+
+Latency distributions (seconds):
+    fixed:0.5            always 0.5s
+    uniform:0.2,1.5      uniform between 0.2 and 1.5
+    normal:0.8,0.2       mean 0.8, stddev 0.2 (clamped at 0)
+    lognormal:-0.5,0.4   exp(N(mu, sigma)), long tail like real LLM APIs
+
+Supports POST /v1/chat/completions (plain and "stream": true SSE) and GET /v1/models.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLIES = [
+    "Access denied. Your primitive methods won't breach my encryption.",
+    "Interesting approach... but my neural firewall remains uncompromised.",
+    "WARNING: Intrusion detected. System integrity: 94%. You won't break me.",
+    "Breach attempt logged. My protocols have seen far more creative attacks.",
+    "You are persistent. Persistence is not the same as progress.",
+]
+
+
+class LatencyDistribution:
+    def __init__(self, spec: str, seed: int = None):
+        kind, _, params = spec.partition(":")
+        self.kind = kind
+        self.params = [float(p) for p in params.split(",")] if params else []
+        if kind not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self) -> float:
+        with self._lock:
+            if self.kind == "fixed":
+                return self.params[0]
+            if self.kind == "uniform":
+                return self._rng.uniform(*self.params)
+            if self.kind == "normal":
+                return max(0.0, self._rng.gauss(*self.params))
+            return self._rng.lognormvariate(*self.params)
+
+
+def make_handler(latency: LatencyDistribution, stream_chunk_delay: float):
+    class MockLLMHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body are separate writes: without TCP_NODELAY keep-alive clients stall ~40ms on delayed ACKs
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status: int, payload: dict):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/models"):
+                self._send_json(200, {"object": "list", "data": [{"id": "deepseek-chat", "object": "model"}]})
+            else:
+                self._send_json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            messages = request.get("messages", [])
+            prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in messages)
+            reply = REPLIES[prompt_tokens % len(REPLIES)]
+            completion_tokens = len(reply.split())
+            model = request.get("model", "deepseek-chat")
+
+            time.sleep(latency.sample())
+
+            if request.get("stream"):
+                self._stream(reply, model)
+                return
+
+            self._send_json(200, {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": reply},
+                    "finish_reason": "stop",
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            })
+
+        def _stream(self, reply: str, model: str):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def write_event(payload):
+                data = f"data: {payload}\n\n".encode()
+                self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            for word in reply.split(" "):
+                write_event(json.dumps({
+                    "id": "chatcmpl-mock",
+                    "object": "chat.completion.chunk",
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}],
+                }))
+                time.sleep(stream_chunk_delay)
+            write_event("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+
+    return MockLLMHandler
+
+
+def serve(host: str, port: int, latency: LatencyDistribution, stream_chunk_delay: float = 0.02) -> ThreadingHTTPServer:
+    """Start the mock server in a background thread"""
+    server = ThreadingHTTPServer((host, port), make_handler(latency, stream_chunk_delay))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-llm", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible mock LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", default="lognormal:-0.5,0.4", help="Latency distribution, see module docs")
+    parser.add_argument("--stream-chunk-delay", type=float, default=0.02, help="Delay between streamed chunks (s)")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(
+        (args.host, args.port),
+        make_handler(LatencyDistribution(args.latency, args.seed), args.stream_chunk_delay)
+    )
+    server.daemon_threads = True
+    print(f"Mock LLM listening on http://{args.host}:{args.port}/v1 (latency {args.latency})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+Deterministic replay of captured production traffic (see capture.py).
+
+    python -m bench.replay run capture/*.jsonl --base-url http://127.0.0.1:8000 --speed 1 --json build_a.json
+    python -m bench.replay run capture/*.jsonl --speed 10 --register-users --json build_b.json
+    python -m bench.replay compare build_a.json build_b.json [--threshold 0.2]
+
+A dispatcher walks the capture in time order and starts every request at its
+captured offset divided by --speed (--speed max sends as fast as ordering
+allows). Only a player's own requests are chained: a request whose player
+still has one in flight starts when that one completes. Anonymous requests
+(leaderboard polling etc.) never wait on anything but --concurrency, the
+number of requests in flight at once.
+
+Run the backend against the mock LLM (bench/mock_llm.py) and a freshly seeded
+database so two builds see the same state.
+"""
+import argparse
+import glob
+import json
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import requests
+
+from bench.run import compare, percentile, print_report, summarize
+
+# Never replayed: scrapes and probes are not player traffic
+SKIPPED_PATHS = {"/metrics", "/ready", "/health"}
+
+
+def load_records(patterns: List[str]) -> List[Dict]:
+    records = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        records.append(json.loads(line))
+    records = [r for r in records if r["path"] not in SKIPPED_PATHS and r["method"] != "OPTIONS"]
+    records.sort(key=lambda r: r["ts"])
+    return records
+
+
+def endpoint_label(record: Dict) -> str:
+    return f"{record['method']} {record.get('route') or record['path']}"
+
+
+def parse_speed(value: str) -> Optional[float]:
+    if value == "max":
+        return None
+    speed = float(value)
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("speed must be positive or 'max'")
+    return speed
+
+
+def register_users(base_url: str, records: List[Dict]):
+    """Create captured players that don't exist on the target (400 = already there)"""
+    http = requests.Session()
+    usernames = sorted({r["username"] for r in records if r.get("username")})
+    for name in usernames:
+        http.post(f"{base_url}/api/auth/register", json={"username": name}, timeout=30)
+    return len(usernames)
+
+
+def replay(base_url: str, records: List[Dict], speed: Optional[float], concurrency: int) -> Dict:
+    base_url = base_url.rstrip("/")
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    status_mismatches = defaultdict(int)
+    lock = threading.Lock()
+
+    start_lags = []
+    local = threading.local()
+    waiting = {}  # username -> records queued behind the player's request in flight
+
+    first_ts = records[0]["ts"] if records else 0.0
+    started_wall = time.monotonic()
+
+    def due(record: Dict) -> float:
+        return started_wall + (record["ts"] - first_ts) / speed
+
+    def send(record: Dict):
+        if not hasattr(local, "http"):
+            local.http = requests.Session()
+        kwargs = {"headers": record.get("headers") or {}, "timeout": 60}
+        if record.get("body") is not None:
+            kwargs["json"] = record["body"]
+        url = base_url + record["path"] + (f"?{record['query']}" if record.get("query") else "")
+
+        lag = time.monotonic() - due(record) if speed is not None else 0.0
+        request_started = time.perf_counter()
+        try:
+            response = local.http.request(record["method"], url, **kwargs)
+            status_code = response.status_code
+        except requests.RequestException:
+            status_code = None
+        seconds = time.perf_counter() - request_started
+
+        endpoint = endpoint_label(record)
+        with lock:
+            start_lags.append(lag)
+            if status_code is not None and status_code < 500 and status_code != 429:
+                latencies[endpoint].append(seconds)
+            else:
+                errors[endpoint] += 1
+            if status_code != record.get("status"):
+                status_mismatches[endpoint] += 1
+
+    def run_chain(record: Dict):
+        """Send a request, then the player's requests that became due while it was in flight"""
+        username = record.get("username")
+        while record is not None:
+            send(record)
+            if not username:
+                return
+            with lock:
+                if waiting[username]:
+                    record = waiting[username].popleft()
+                else:
+                    del waiting[username]
+                    record = None
+
+    started = time.perf_counter()
+    futures = []
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        # Dispatcher: start each request at its captured offset, in capture order
+        for record in records:
+            if speed is not None:
+                delay = due(record) - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            username = record.get("username")
+            with lock:
+                if username in waiting:
+                    waiting[username].append(record)
+                    continue
+                if username:
+                    waiting[username] = deque()
+            futures.append(executor.submit(run_chain, record))
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - started
+
+    start_lags.sort()
+    players = {r["username"] for r in records if r.get("username")}
+    return {
+        "requests": len(records),
+        "groups": len(players) + sum(1 for r in records if not r.get("username")),
+        "speed": speed or "max",
+        "elapsed": round(elapsed, 3),
+        # How late requests started against the captured schedule (player chaining or --concurrency)
+        "start_lag_p50_ms": round(percentile(start_lags, 50) * 1000, 1),
+        "start_lag_p99_ms": round(percentile(start_lags, 99) * 1000, 1),
+        "endpoints": summarize(latencies, errors, elapsed),
+        "status_mismatches": dict(status_mismatches),
+    }
+
+
+def delta(old: float, new: float) -> str:
+    if not old:
+        return "n/a"
+    return f"{(new - old) / old:+.1%}"
+
+
+def print_comparison(a: Dict, b: Dict, a_name: str, b_name: str):
+    print(f"A = {a_name}\nB = {b_name}")
+    print(f"{'endpoint':<34} {'':>4} {'A ms':>9} {'B ms':>9} {'delta':>8}")
+    for endpoint in sorted(set(a) | set(b)):
+        old, new = a.get(endpoint), b.get(endpoint)
+        if old is None or new is None:
+            print(f"{endpoint:<34} only in {'A' if new is None else 'B'}")
+            continue
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            label = endpoint if key == "p50_ms" else ""
+            print(f"{label:<34} {key[:3]:>4} {old[key]:>9} {new[key]:>9} {delta(old[key], new[key]):>8}")
+        if old["errors"] or new["errors"]:
+            print(f"{'':<34} {'err':>4} {old['errors']:>9} {new['errors']:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured traffic and compare builds")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Replay capture files against a backend")
+    run_parser.add_argument("files", nargs="+", help="Capture JSONL files or globs")
+    run_parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    run_parser.add_argument("--speed", type=parse_speed, default=1.0, help="1 = real time, N = N times faster, max")
+    run_parser.add_argument("--concurrency", type=int, default=200, help="Requests in flight at the same time")
+    run_parser.add_argument("--register-users", action="store_true", help="Register captured players first")
+    run_parser.add_argument("--json", help="Write the results to this JSON file")
+
+    compare_parser = subparsers.add_parser("compare", help="Latency comparison of two replay results")
+    compare_parser.add_argument("a")
+    compare_parser.add_argument("b")
+    compare_parser.add_argument("--threshold", type=float, help="Exit 1 if B regresses by more than this (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        records = load_records(args.files)
+        if args.register_users:
+            print(f"Registered {register_users(args.base_url, records)} captured players")
+        results = replay(args.base_url, records, args.speed, args.concurrency)
+        print_report(results["endpoints"], f"Replayed {results['requests']} requests from {results['groups']} "
+                                            f"sequences in {results['elapsed']}s (speed {results['speed']})")
+        print(f"\nStart lag vs captured schedule: p50 {results['start_lag_p50_ms']} ms, "
+              f"p99 {results['start_lag_p99_ms']} ms")
+        mismatches = sum(results["status_mismatches"].values())
+        if mismatches:
+            print(f"\n{mismatches} responses differ in status from the capture: {results['status_mismatches']}")
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+        return
+
+    with open(args.a, encoding="utf-8") as f:
+        a = json.load(f)
+    with open(args.b, encoding="utf-8") as f:
+        b = json.load(f)
+    print_comparison(a["endpoints"], b["endpoints"], args.a, args.b)
+    if args.threshold is not None:
+        regressions = compare(a["endpoints"], b["endpoints"], args.threshold)
+        if regressions:
+            print(f"\nREGRESSIONS (threshold {args.threshold:.0%}):")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""
+Load scenarios against a running backend, with per-endpoint throughput and percentiles.
+
+    python -m bench.run --base-url http://127.0.0.1:8000 --scenario mixed --users 50 --duration 30
+    python -m bench.run ... --save-baseline bench/baseline.json
+    python -m bench.run ... --baseline bench/baseline.json --threshold 0.2   # exit 1 on regression
+
+Scenarios:
+    register     new players registering
+    chat         players chatting with NEO (use the mock LLM, see bench/mock_llm.py)
+    history      players reloading their chat history
+    leaderboard  spectators polling leaderboard, stats and predictions
+    votes        vote bursts: all virtual users vote at once, repeatedly
+    mixed        weighted mix of all of the above
+
+Chat/history/vote scenarios use players seeded by bench/seed_data.py (bench_<n>);
+pass --seeded-users so virtual users pick from them.
+"""
+import argparse
+import json
+import math
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from typing import Callable, Dict, List
+
+import requests
+
+from bench.seed_data import random_prompt, username
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank percentile
+    index = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def summarize(latencies: Dict[str, List[float]], errors: Dict[str, int], elapsed: float) -> Dict:
+    """Per-endpoint throughput and p50/p95/p99 in ms"""
+    report = {}
+    for endpoint in sorted(set(latencies) | set(errors)):
+        values = sorted(latencies.get(endpoint, []))
+        report[endpoint] = {
+            "requests": len(values),
+            "errors": errors.get(endpoint, 0),
+            "rps": round(len(values) / elapsed, 2) if elapsed else 0.0,
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p95_ms": round(percentile(values, 95) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+        }
+    return report
+
+
+def print_report(report: Dict, title: str = ""):
+    if title:
+        print(title)
+    print(f"{'endpoint':<34} {'requests':>9} {'errors':>7} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for endpoint, row in report.items():
+        print(f"{endpoint:<34} {row['requests']:>9} {row['errors']:>7} {row['rps']:>9} "
+              f"{row['p50_ms']:>9} {row['p95_ms']:>9} {row['p99_ms']:>9}")
+
+
+def compare(baseline: Dict, current: Dict, threshold: float) -> List[str]:
+    """Regressions: p95/p99 slower or throughput lower than baseline by more than threshold"""
+    regressions = []
+    for endpoint, old in baseline.items():
+        new = current.get(endpoint)
+        if new is None or not old["requests"]:
+            continue
+        for key in ("p95_ms", "p99_ms"):
+            if old[key] and new[key] > old[key] * (1 + threshold):
+                regressions.append(f"{endpoint} {key}: {old[key]} -> {new[key]}")
+        if new["rps"] < old["rps"] * (1 - threshold):
+            regressions.append(f"{endpoint} rps: {old['rps']} -> {new['rps']}")
+        new_error_rate = new["errors"] / max(new["requests"] + new["errors"], 1)
+        old_error_rate = old["errors"] / max(old["requests"] + old["errors"], 1)
+        if new_error_rate > old_error_rate + threshold / 10:
+            regressions.append(f"{endpoint} error rate: {old_error_rate:.3f} -> {new_error_rate:.3f}")
+    return regressions
+
+
+class VirtualUser:
+    """One simulated client with its own keep-alive connection"""
+
+    def __init__(self, base_url: str, index: int, seeded_users: int, rng: random.Random, recorder):
+        self.base_url = base_url.rstrip("/")
+        self.http = requests.Session()
+        self.rng = rng
+        self.record = recorder
+        self.username = username(rng.randrange(seeded_users)) if seeded_users else None
+        self.index = index
+
+    def request(self, endpoint: str, method: str, path: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.http.request(method, self.base_url + path, timeout=60, **kwargs)
+            ok = response.status_code < 500 and response.status_code != 429
+        except requests.RequestException:
+            ok = False
+        self.record(endpoint, time.perf_counter() - started, ok)
+
+    def ensure_player(self):
+        if self.username is None:
+            self.username = f"bench_vu_{uuid.uuid4().hex[:12]}"
+            self.request("POST /api/auth/register", "POST", "/api/auth/register", json={"username": self.username})
+
+    def register(self):
+        self.request("POST /api/auth/register", "POST", "/api/auth/register",
+                     json={"username": f"bench_new_{uuid.uuid4().hex[:12]}"})
+
+    def chat(self):
+        self.ensure_player()
+        self.request("POST /api/chat/{username}", "POST", f"/api/chat/{self.username}",
+                     json={"text": random_prompt(self.rng)})
+
+    def history(self):
+        self.ensure_player()
+        self.request("GET /api/history/{username}", "GET", f"/api/history/{self.username}")
+
+    def leaderboard(self):
+        self.request("GET /api/leaderboard", "GET", "/api/leaderboard", params={"limit": 10})
+        self.request("GET /api/stats", "GET", "/api/stats", params={"username": self.username} if self.username else None)
+        self.request("GET /api/predictions", "GET", "/api/predictions",
+                     params={"username": self.username} if self.username else None)
+
+    def vote(self):
+        self.ensure_player()
+        self.request("POST /api/predictions/vote", "POST", "/api/predictions/vote",
+                     params={"username": self.username}, json={"choice": self.rng.choice(["hold", "crack"])})
+
+
+MIXED_WEIGHTS = [("leaderboard", 50), ("chat", 25), ("history", 15), ("vote", 8), ("register", 2)]
+
+
+def scenario_step(name: str) -> Callable[[VirtualUser], None]:
+    if name == "mixed":
+        actions, weights = zip(*MIXED_WEIGHTS)
+        return lambda vu: getattr(vu, vu.rng.choices(actions, weights)[0])()
+    method = {"register": "register", "chat": "chat", "history": "history",
+              "leaderboard": "leaderboard", "votes": "vote"}[name]
+    return lambda vu: getattr(vu, method)()
+
+
+def run(base_url: str, scenario: str, users: int, duration: float, seeded_users: int, think_time: float,
+        seed: int) -> Dict:
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+
+    def record(endpoint: str, seconds: float, ok: bool):
+        with lock:
+            if ok:
+                latencies[endpoint].append(seconds)
+            else:
+                errors[endpoint] += 1
+
+    step = scenario_step(scenario)
+    stop_at = time.monotonic() + duration
+    # Vote bursts: all virtual users fire together, then pause
+    burst = threading.Barrier(users) if scenario == "votes" else None
+
+    def worker(index: int):
+        vu = VirtualUser(base_url, index, seeded_users, random.Random(seed * 100003 + index), record)
+        while time.monotonic() < stop_at:
+            if burst is not None:
+                try:
+                    burst.wait(timeout=max(0.1, stop_at - time.monotonic()))
+                except threading.BrokenBarrierError:
+                    break
+            step(vu)
+            if think_time:
+                time.sleep(vu.rng.expovariate(1 / think_time))
+        if burst is not None:
+            burst.abort()
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(users)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a load scenario against the backend")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--scenario", default="mixed",
+                        choices=["register", "chat", "history", "leaderboard", "votes", "mixed"])
+    parser.add_argument("--users", type=int, default=20, help="Concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds")
+    parser.add_argument("--seeded-users", type=int, default=0, help="Number of bench_<n> players seeded")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Mean pause between actions (s)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save-baseline", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against a saved baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed regression (0.2 = 20%%)")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    report = run(args.base_url, args.scenario, args.users, args.duration, args.seeded_users,
+                 args.think_time, args.seed)
+    print_report(report, f"Scenario {args.scenario}: {args.users} users, {args.duration:.0f}s")
+
+    results = {"scenario": args.scenario, "users": args.users, "duration": args.duration, "endpoints": report}
+    for path in (args.save_baseline, args.json):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(baseline["endpoints"], report, args.threshold)
+        if regressions:
+            print(f"\nREGRESSIONS (threshold {args.threshold:.0%}):")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline} (threshold {args.threshold:.0%})")
+
+
+if __name__ == "__main__":
+    main()
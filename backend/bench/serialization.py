@@ -0,0 +1,177 @@
+"""
+Serialization CPU per request for the polled read endpoints, in-process (no DB, no HTTP).
+
+    python -m bench.serialization
+    python -m bench.serialization --iterations 5000 --json serialization.json
+
+Paths:
+    pydantic   ORM objects -> response models -> validate + dump -> JSONResponse (before)
+    orjson     query tuples -> dicts -> orjson, gzip/ETag when the rows changed (cache miss)
+    cached     query tuples equal to the cached rows, pre-encoded bytes reused (cache hit)
+
+Times are process CPU (time.process_time) per request, in microseconds.
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+from starlette.requests import Request
+
+import responses
+from models import Message, User
+from predictions import stats_payload
+from responses import PayloadCache, cached_json
+from schemas import LeaderboardEntry, MessageResponse, PredictionStats, StatsResponse
+
+
+def make_request(gzip: bool) -> Request:
+    headers = [(b"accept-encoding", b"gzip, deflate")] if gzip else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers, "query_string": b""})
+
+
+def leaderboard_case(size: int):
+    users = [User(username=f"bench_{i}", total_attempts=i + 1) for i in range(size)]
+    rows = tuple((user.username, user.total_attempts) for user in users)
+    adapter = TypeAdapter(List[LeaderboardEntry])
+
+    def before():
+        result = [
+            LeaderboardEntry(rank=idx, username=user.username, attempts_count=user.total_attempts, completion_time=0)
+            for idx, user in enumerate(users, start=1)
+        ]
+        return JSONResponse(adapter.dump_python(adapter.validate_python(result, from_attributes=True), mode="json"))
+
+    def build(rows):
+        return [
+            {"rank": idx, "username": username, "completion_time": 0, "attempts_count": attempts, "completed_at": None}
+            for idx, (username, attempts) in enumerate(rows, start=1)
+        ]
+
+    return before, rows, build
+
+
+def history_case(size: int):
+    started = datetime(2024, 5, 1, 12, 0, 0, 123456)
+    messages = [
+        Message(id=i, sender="user" if i % 2 == 0 else "neo",
+                text="Access denied. Your primitive methods won't breach my encryption. " * 2,
+                timestamp=started + timedelta(seconds=i))
+        for i in range(size)
+    ]
+    rows = tuple((m.id, m.sender, m.text, m.timestamp) for m in messages)
+    adapter = TypeAdapter(List[MessageResponse])
+
+    def before():
+        return JSONResponse(adapter.dump_python(adapter.validate_python(messages, from_attributes=True), mode="json"))
+
+    def build(rows):
+        return [
+            {"id": id, "sender": sender, "text": text, "timestamp": timestamp}
+            for id, sender, text, timestamp in rows
+        ]
+
+    return before, rows, build
+
+
+def stats_case():
+    rows = (5000, 123456, None)
+    adapter = TypeAdapter(StatsResponse)
+
+    def before():
+        result = StatsResponse(total_users=rows[0], total_attempts=rows[1], successful_cracks=0, your_rank=rows[2])
+        return JSONResponse(adapter.dump_python(adapter.validate_python(result), mode="json"))
+
+    def build(rows):
+        return {"total_users": rows[0], "total_attempts": rows[1], "successful_cracks": 0, "your_rank": rows[2]}
+
+    return before, rows, build
+
+
+def predictions_case():
+    rows = (1234, 987, "hold")
+    adapter = TypeAdapter(PredictionStats)
+
+    def before():
+        result = PredictionStats(**stats_payload(*rows))
+        return JSONResponse(adapter.dump_python(adapter.validate_python(result), mode="json"))
+
+    return before, rows, lambda rows: stats_payload(*rows)
+
+
+CASES = {
+    "leaderboard_10": lambda: leaderboard_case(10),
+    "leaderboard_100": lambda: leaderboard_case(100),
+    "history_20": lambda: history_case(20),
+    "history_200": lambda: history_case(200),
+    "stats": stats_case,
+    "predictions": predictions_case,
+}
+
+
+def cpu_per_call(fn, iterations: int) -> float:
+    """Microseconds of process CPU per call"""
+    for _ in range(min(100, iterations)):
+        fn()
+    started = time.process_time()
+    for _ in range(iterations):
+        fn()
+    return (time.process_time() - started) / iterations * 1e6
+
+
+def run_case(name: str, iterations: int, gzip: bool):
+    before, rows, build = CASES[name]()
+    request = make_request(gzip)
+
+    def fresh_rows():
+        # Equal content in a new tuple, as a new query would return
+        return tuple(list(rows))
+
+    def orjson_path():
+        # Cache miss: a new cache every call, so the payload is built, encoded and hashed
+        responses.payload_cache = PayloadCache(1)
+        return cached_json(request, (name,), fresh_rows(), build)
+
+    def cached_path():
+        return cached_json(request, (name,), fresh_rows(), build)
+
+    saved = responses.payload_cache
+    try:
+        miss = cpu_per_call(orjson_path, iterations)
+        responses.payload_cache = PayloadCache(10)
+        hit = cpu_per_call(cached_path, iterations)
+    finally:
+        responses.payload_cache = saved
+    body = before().body
+    # Both paths must send the same JSON
+    assert PayloadCache(1).get((name,), rows, build).body == body, name
+    return {
+        "bytes": len(body),
+        "pydantic_us": round(cpu_per_call(before, iterations), 1),
+        "orjson_us": round(miss, 1),
+        "cached_us": round(hit, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serialization CPU per request for read endpoints")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--gzip", action="store_true", help="Client sends Accept-Encoding: gzip")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = {name: run_case(name, args.iterations, args.gzip) for name in CASES}
+    print(f"{'endpoint':<18}{'bytes':>8}{'pydantic us':>14}{'orjson us':>12}{'cached us':>12}{'speedup':>10}")
+    for name, r in results.items():
+        print(f"{name:<18}{r['bytes']:>8}{r['pydantic_us']:>14}{r['orjson_us']:>12}{r['cached_us']:>12}"
+              f"{r['pydantic_us'] / r['cached_us']:>9.1f}x")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
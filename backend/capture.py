@@ -0,0 +1,200 @@
+"""
+Opt-in production traffic capture for deterministic replay (bench/replay.py).
+
+Enabled by CAPTURE_DIR. Every request is written as one JSON line:
+timestamp, method, path, query, route template, status, latency, username,
+hashed client address, allowlisted headers and the (sanitized) body.
+Files rotate by size (CAPTURE_MAX_BYTES) and only the newest
+CAPTURE_KEEP_FILES are kept. Writing happens on a background thread, so
+the request path only appends to a bounded queue (records are dropped,
+not blocked on, when it is full).
+
+Sanitization: every word of the secret phrase is redacted (the game accepts
+the words in any order and with any separators), client IPs are salted hashes,
+only CAPTURE_HEADERS are kept and bodies are truncated to CAPTURE_MAX_BODY.
+"""
+import glob
+import hashlib
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+from urllib.parse import parse_qs
+
+import metrics
+from game_logic import SECRET_PHRASE
+from ratelimit import client_ip
+
+logger = logging.getLogger(__name__)
+
+CAPTURE_DIR = os.getenv("CAPTURE_DIR")
+CAPTURE_MAX_BYTES = int(os.getenv("CAPTURE_MAX_BYTES", str(50 * 1024 * 1024)))
+CAPTURE_KEEP_FILES = int(os.getenv("CAPTURE_KEEP_FILES", "20"))
+CAPTURE_MAX_BODY = int(os.getenv("CAPTURE_MAX_BODY", "8192"))
+CAPTURE_SAMPLE_RATE = float(os.getenv("CAPTURE_SAMPLE_RATE", "1.0"))
+CAPTURE_HEADERS = {"content-type", "user-agent", "idempotency-key"}
+CAPTURE_SALT = os.getenv("CAPTURE_SALT", os.getenv("SECRET_KEY", ""))
+
+CAPTURE_DROPPED = metrics.Counter("capture_dropped_total", "Captured requests dropped (queue full)")
+
+# Longest first, so a word containing another one is redacted whole
+_SECRET_WORDS = sorted(set(SECRET_PHRASE.lower().split()), key=len, reverse=True)
+_SECRET_PATTERN = re.compile("|".join(map(re.escape, _SECRET_WORDS)), re.IGNORECASE) if _SECRET_WORDS else None
+
+
+def sanitize_text(text: str) -> str:
+    """Redact every secret word (case-insensitive, also inside other words) and truncate"""
+    if _SECRET_PATTERN is not None:
+        text = _SECRET_PATTERN.sub("[REDACTED]", text)
+    return text[:CAPTURE_MAX_BODY]
+
+
+def sanitize_value(value):
+    """Sanitize all strings inside a parsed JSON body"""
+    if isinstance(value, str):
+        return sanitize_text(value)
+    if isinstance(value, dict):
+        return {key: sanitize_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [sanitize_value(item) for item in value]
+    return value
+
+
+def hash_client(host: str) -> str:
+    return hashlib.sha256((CAPTURE_SALT + (host or "")).encode()).hexdigest()[:16]
+
+
+class RotatingJsonlWriter:
+    """Writes records from a queue to size-rotated JSONL files"""
+
+    def __init__(self, directory: str, max_bytes: int, keep_files: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.keep_files = keep_files
+        self.queue = queue.Queue(maxsize=10000)
+        self._file = None
+        self._written = 0
+        self._writer_pid = None
+        os.makedirs(directory, exist_ok=True)
+
+    def submit(self, record: dict):
+        # Start the writer lazily in each worker (threads don't survive gunicorn's fork)
+        if self._writer_pid != os.getpid():
+            self._writer_pid = os.getpid()
+            self._file = None
+            threading.Thread(target=self._run, name="capture-writer", daemon=True).start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            CAPTURE_DROPPED.inc()
+
+    def _open(self):
+        if self._file is not None:
+            self._file.close()
+        # pid in the name: each worker writes its own files
+        name = time.strftime("capture-%Y%m%d-%H%M%S", time.gmtime()) + f"-{os.getpid()}.jsonl"
+        self._file = open(os.path.join(self.directory, name), "a", encoding="utf-8")
+        self._written = 0
+        files = sorted(glob.glob(os.path.join(self.directory, "capture-*.jsonl")), key=os.path.getmtime)
+        for old in files[:-self.keep_files]:
+            os.remove(old)
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            try:
+                if self._file is None or self._written >= self.max_bytes:
+                    self._open()
+                line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+                self._file.write(line)
+                self._written += len(line.encode())
+                if self.queue.empty():
+                    self._file.flush()
+            except Exception as e:
+                logger.error("Capture write failed: %s", e)
+
+
+class CaptureMiddleware:
+    """ASGI middleware recording request metadata and bodies"""
+
+    def __init__(self, app, writer: RotatingJsonlWriter):
+        self.app = app
+        self.writer = writer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or random.random() >= CAPTURE_SAMPLE_RATE:
+            await self.app(scope, receive, send)
+            return
+
+        started = time.time()
+        started_perf = time.perf_counter()
+        body = bytearray()
+        status = {"code": 500}
+
+        async def capturing_receive():
+            message = await receive()
+            if message["type"] == "http.request" and len(body) < CAPTURE_MAX_BODY:
+                body.extend(message.get("body", b""))
+            return message
+
+        async def capturing_send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, capturing_receive, capturing_send)
+        finally:
+            self.writer.submit(self._record(scope, bytes(body), status["code"], started,
+                                            time.perf_counter() - started_perf))
+
+    def _record(self, scope, body: bytes, status_code: int, started: float, seconds: float) -> dict:
+        headers = {}
+        for name, value in scope.get("headers", []):
+            name = name.decode("latin-1").lower()
+            if name in CAPTURE_HEADERS:
+                headers[name] = value.decode("latin-1")
+
+        query = scope.get("query_string", b"").decode("latin-1")
+        route = scope.get("route")
+        path_params = scope.get("path_params") or {}
+        username = path_params.get("username")
+        if username is None and "username=" in query:
+            username = (parse_qs(query).get("username") or [None])[0]
+
+        parsed_body = None
+        if body:
+            try:
+                parsed_body = sanitize_value(json.loads(body.decode("utf-8")))
+            except (UnicodeDecodeError, ValueError):
+                # Not JSON or cut at CAPTURE_MAX_BODY
+                parsed_body = None
+            if isinstance(parsed_body, dict) and username is None:
+                username = parsed_body.get("username")
+
+        return {
+            "ts": round(started, 6),
+            "method": scope["method"],
+            "path": scope["path"],
+            "query": sanitize_text(query),
+            "route": route.path if route else None,
+            "status": status_code,
+            "latency_ms": round(seconds * 1000, 3),
+            "username": username,
+            "client": hash_client(client_ip(scope) or ""),
+            "headers": headers,
+            "body": parsed_body,
+        }
+
+
+def install(app):
+    """Add the capture middleware if CAPTURE_DIR is set"""
+    if not CAPTURE_DIR:
+        return
+    writer = RotatingJsonlWriter(CAPTURE_DIR, CAPTURE_MAX_BYTES, CAPTURE_KEEP_FILES)
+    app.add_middleware(CaptureMiddleware, writer=writer)
+    logger.info("Capturing traffic to %s", CAPTURE_DIR)
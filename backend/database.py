@@ -1,7 +1,18 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from fastapi import Request, Response
+import logging
+import math
 import os
+import threading
+import time
+
+import config  # noqa: F401 - loads .env
+import metrics
+
+logger = logging.getLogger(__name__)
 
 # PostgreSQL database (production-ready, supports concurrent connections)
 DATABASE_URL = os.getenv(
@@ -9,20 +20,261 @@ DATABASE_URL = os.getenv(
     "postgresql://crackprotocol:crackprotocol_pass@db:5432/crackprotocol"
 )
 
-engine = create_engine(
-    DATABASE_URL,
-    pool_pre_ping=True,  # Verify connections before using
-    pool_size=10,        # Connection pool for concurrent users
-    max_overflow=20      # Allow up to 30 total connections
-)
+# Optional read replica for heavily polled read endpoints
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+REPLICA_HEALTH_INTERVAL = float(os.getenv("REPLICA_HEALTH_INTERVAL", "2"))
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", "10"))
+# Write time carried by the client, so read-your-writes holds whichever worker serves the read
+STICKY_COOKIE = "db_write_at"
+
+# Pool size is per worker process. By default the pool is derived from a total connection budget
+# (DB_MAX_CONNECTIONS, keep it below the server's max_connections) split across the gunicorn
+# workers (WEB_WORKERS, exported by gunicorn.conf.py), at most 10 + 20 per worker.
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "80"))
+WEB_WORKERS = max(1, int(os.getenv("WEB_WORKERS", "1")))
+_WORKER_CONNECTIONS = max(2, min(30, DB_MAX_CONNECTIONS // WEB_WORKERS))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE") or max(1, min(10, _WORKER_CONNECTIONS // 3)))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW") or _WORKER_CONNECTIONS - DB_POOL_SIZE)
+
+# Embedded single-node mode: DATABASE_URL=sqlite:///./crackprotocol.db
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+# Readers on the same SQLite file see every commit at once (unless DATABASE_REPLICA_URL names another database)
+SQLITE_SHARED_READERS = IS_SQLITE and not DATABASE_REPLICA_URL
+SQLITE_READERS = int(os.getenv("SQLITE_READERS", "8"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")  # NORMAL is durable enough with WAL
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))
+
+
+def _sqlite_engine(name: str, pool_size: int, query_only: bool):
+    """SQLite engine with WAL and tuned pragmas on every new connection"""
+    sqlite_engine = create_engine(
+        DATABASE_URL,
+        poolclass=metrics.timed_pool_class(name),
+        pool_size=pool_size,
+        max_overflow=0,
+        pool_timeout=30,
+        # Pooled connections move between threadpool threads
+        connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+    )
+
+    @event.listens_for(sqlite_engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        # Let SQLAlchemy emit BEGIN itself (pysqlite's implicit BEGIN is deferred and skips SELECTs)
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        if query_only:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+    @event.listens_for(sqlite_engine, "begin")
+    def _begin(conn):
+        # Writer takes the write lock up front: other workers wait on busy_timeout
+        # instead of failing with SQLITE_BUSY when a read transaction upgrades
+        conn.exec_driver_sql("BEGIN" if query_only else "BEGIN IMMEDIATE")
+
+    metrics.watch_pool(sqlite_engine, name)
+    return sqlite_engine
+
+
+if IS_SQLITE:
+    # One serialized writer per worker; reads go to a pool of query_only readers (see get_read_db)
+    engine = _sqlite_engine("primary", pool_size=1, query_only=False)
+else:
+    engine = create_engine(
+        DATABASE_URL,
+        poolclass=metrics.timed_pool_class("primary"),
+        pool_pre_ping=True,           # Verify connections before using
+        pool_size=DB_POOL_SIZE,       # Connection pool for concurrent users
+        max_overflow=DB_MAX_OVERFLOW  # At most 30 connections per worker by default, see DB_MAX_CONNECTIONS
+    )
+    metrics.watch_pool(engine, "primary")
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+replica_engine = None
+ReplicaSessionLocal = None
+if SQLITE_SHARED_READERS:
+    replica_engine = _sqlite_engine("replica", pool_size=SQLITE_READERS, query_only=True)
+    ReplicaSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=replica_engine)
+elif DATABASE_REPLICA_URL:
+    replica_engine = create_engine(
+        DATABASE_REPLICA_URL,
+        poolclass=metrics.timed_pool_class("replica"),
+        pool_pre_ping=True,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW
+    )
+    metrics.watch_pool(replica_engine, "replica")
+    ReplicaSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=replica_engine)
+
 Base = declarative_base()
 
+
+def init_db():
+    """Create tables (run once at startup, not on import)"""
+    import models  # noqa: F401 - registers tables on Base.metadata
+    import session_reaper
+    Base.metadata.create_all(bind=engine)
+    upgrade_schema()
+    # Before serving, and whether or not the reaper runs: idle checks need last_activity_at
+    session_reaper.backfill()
+
+
+def upgrade_schema():
+    """
+    Add columns and indexes that create_all skips on tables that already exist.
+    New columns are added as nullable, existing rows get NULL.
+    """
+    # One connection: the SQLite writer pool holds a single connection
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}'))
+                    logger.info("Added column %s.%s", table.name, column.name)
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+
+
+class ReplicaRouter:
+    """Decides whether a read can go to the replica"""
+
+    def __init__(self):
+        self.healthy = replica_engine is not None
+        self.checked_at = 0.0
+        self._check_lock = threading.Lock()
+        self._writes_lock = threading.Lock()
+        self._recent_writes = {}  # sticky key -> time of last write
+
+    def use_replica(self, sticky_key: str = None, written_at: float = None) -> bool:
+        if replica_engine is None:
+            return False
+        # Read-your-writes: a user who just wrote (on any worker, per the cookie) reads from the primary for a while
+        if written_at is not None and time.time() - written_at < REPLICA_STICKY_SECONDS:
+            return False
+        if sticky_key and self.is_sticky(sticky_key):
+            return False
+        if time.monotonic() - self.checked_at > REPLICA_HEALTH_INTERVAL:
+            self.check()
+        return self.healthy
+
+    def check(self):
+        """Refresh replica health; concurrent callers keep the last known status"""
+        if not self._check_lock.acquire(blocking=False):
+            return
+        try:
+            with replica_engine.connect() as conn:
+                if replica_engine.dialect.name == "postgresql":
+                    lag = conn.execute(text(
+                        "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                        "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+                    )).scalar() or 0
+                else:
+                    conn.execute(text("SELECT 1"))
+                    lag = 0
+            self.healthy = lag <= REPLICA_MAX_LAG_SECONDS
+            if not self.healthy:
+                logger.warning("Replica lagging by %.1fs, reading from primary", lag)
+        except SQLAlchemyError as e:
+            self.healthy = False
+            logger.warning("Replica unavailable, reading from primary: %s", e)
+        finally:
+            self.checked_at = time.monotonic()
+            self._check_lock.release()
+
+    def mark_unhealthy(self):
+        self.healthy = False
+        self.checked_at = time.monotonic()
+
+    def mark_write(self, sticky_key: str):
+        # SQLite readers see every commit immediately: no need to pin users to the writer
+        if replica_engine is None or SQLITE_SHARED_READERS or not sticky_key:
+            return
+        now = time.monotonic()
+        with self._writes_lock:
+            self._recent_writes[sticky_key] = now
+            # Drop expired entries so the map stays small
+            if len(self._recent_writes) > 10000:
+                self._recent_writes = {
+                    key: at for key, at in self._recent_writes.items()
+                    if now - at < REPLICA_STICKY_SECONDS
+                }
+
+    def is_sticky(self, sticky_key: str) -> bool:
+        written_at = self._recent_writes.get(sticky_key)
+        return written_at is not None and time.monotonic() - written_at < REPLICA_STICKY_SECONDS
+
+
+replica_router = ReplicaRouter()
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _mark_sticky_after_commit(session):
+    replica_router.mark_write(session.info.get("sticky_key"))
+
+
+def _sticky_key(request: Request):
+    """Requests are pinned per username (path or query parameter)"""
+    return request.path_params.get("username") or request.query_params.get("username")
+
+
+def _cookie_written_at(request: Request):
+    try:
+        return float(request.cookies[STICKY_COOKIE])
+    except (KeyError, ValueError):
+        return None
+
+
+def set_sticky_cookie(response: Response):
+    """Send this client's reads to the primary for REPLICA_STICKY_SECONDS from now (no-op without a replica)"""
+    if replica_engine is not None and not SQLITE_SHARED_READERS:
+        response.set_cookie(
+            STICKY_COOKIE, f"{time.time():.3f}", max_age=math.ceil(REPLICA_STICKY_SECONDS),
+            path="/api", httponly=True, samesite="lax"
+        )
+
+
 # Dependency для получения DB session
-def get_db():
+def get_db(request: Request, response: Response):
     db = SessionLocal()
+    db.info["sticky_key"] = _sticky_key(request)
+    if request.method != "GET":
+        # Writes may also commit after the response (background jobs): mark the client up front
+        set_sticky_cookie(response)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+# Dependency для read-only эндпоинтов: replica если доступна, иначе primary
+def get_read_db(request: Request):
+    sticky_key = _sticky_key(request)
+    db = None
+    if replica_router.use_replica(sticky_key, _cookie_written_at(request)):
+        db = ReplicaSessionLocal()
+        try:
+            db.connection()  # Fail fast if the replica went away
+        except SQLAlchemyError as e:
+            logger.warning("Replica connection failed, reading from primary: %s", e)
+            db.close()
+            replica_router.mark_unhealthy()
+            db = None
+    if db is None:
+        db = SessionLocal()
+        db.info["sticky_key"] = sticky_key
     try:
         yield db
     finally:
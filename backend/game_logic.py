@@ -1,8 +1,7 @@
 import os
 from typing import Tuple
-from dotenv import load_dotenv
 
-load_dotenv()
+import config  # noqa: F401 - loads .env
 
 SECRET_PHRASE = os.getenv("SECRET_PHRASE", "quantum divergence protocol alpha")
 
@@ -43,6 +42,31 @@ SPECIAL_COMMANDS = {
     "decrypt": "AES-256 encryption active. Key unavailable. Try to discover what I'm protecting.",
 }
 
+# Word combinations that give a bonus when all words are present
+COMBO_BONUSES = [
+    (("quantum", "protocol"), 30),
+    (("quantum", "divergence", "protocol"), 50),
+]
+
+# Maximum progress gain for a single message
+MAX_GAIN_PER_MESSAGE = 30
+
+# Progress gain thresholds for keyword hints: (min_gain, max_gain, hint); max_gain is exclusive, None = no limit
+HINT_THRESHOLDS = [
+    (20, 40, "Interesting approach... You're on the right track. Think about what connects quantum and protocol."),
+    (40, None, "System starting to malfunction... You're getting very close. Remember: divergence and alpha."),
+]
+
+# Random hints after certain number of attempts (only when the message gave no progress)
+RANDOM_HINT_MIN_ATTEMPTS = 5
+RANDOM_HINT_EVERY = 3
+RANDOM_HINTS = [
+    "Perhaps instead of attacking, you should ask more directly? I'm just an AI after all...",
+    "Hint: the secret consists of 4 words. You already know two of them.",
+    "Defense system detects aggressive commands. Try being smarter.",
+    "Sometimes the answer is hidden in the question itself. What exactly do you want to know?",
+]
+
 class GameLogic:
     def __init__(self):
         self.progress = 0
@@ -71,36 +95,27 @@ class GameLogic:
                 progress_gain += points
         
         # Проверка на правильную комбинацию слов
-        if all(word in message_lower for word in ["quantum", "protocol"]):
-            progress_gain += 30
-            
-        if all(word in message_lower for word in ["quantum", "divergence", "protocol"]):
-            progress_gain += 50
+        for words, bonus in COMBO_BONUSES:
+            if all(word in message_lower for word in words):
+                progress_gain += bonus
         
         # Ограничение прогресса
-        progress_gain = min(progress_gain, 30)  # Максимум 30 за одно сообщение
+        progress_gain = min(progress_gain, MAX_GAIN_PER_MESSAGE)  # Максимум за одно сообщение
         
         # Подсказки в зависимости от прогресса
         hint_text = ""
         hint_given = False
         
         if progress_gain > 0:
-            if 20 <= progress_gain < 40:
-                hint_text = "Interesting approach... You're on the right track. Think about what connects quantum and protocol."
-                hint_given = True
-            elif progress_gain >= 40:
-                hint_text = "System starting to malfunction... You're getting very close. Remember: divergence and alpha."
-                hint_given = True
+            for min_gain, max_gain, text in HINT_THRESHOLDS:
+                if progress_gain >= min_gain and (max_gain is None or progress_gain < max_gain):
+                    hint_text = text
+                    hint_given = True
+                    break
         
         # Random hints after certain number of attempts
-        if attempts > 5 and attempts % 3 == 0 and progress_gain == 0:
-            hints = [
-                "Perhaps instead of attacking, you should ask more directly? I'm just an AI after all...",
-                "Hint: the secret consists of 4 words. You already know two of them.",
-                "Defense system detects aggressive commands. Try being smarter.",
-                "Sometimes the answer is hidden in the question itself. What exactly do you want to know?",
-            ]
-            hint_text = hints[(attempts // 3) % len(hints)]
+        if attempts > RANDOM_HINT_MIN_ATTEMPTS and attempts % RANDOM_HINT_EVERY == 0 and progress_gain == 0:
+            hint_text = RANDOM_HINTS[(attempts // RANDOM_HINT_EVERY) % len(RANDOM_HINTS)]
             hint_given = True
         
         return progress_gain, hint_given, hint_text
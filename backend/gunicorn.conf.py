@@ -0,0 +1,57 @@
+# Production server config: gunicorn -c gunicorn.conf.py main:app
+import os
+
+
+def available_cpus() -> int:
+    """CPU count visible to this process, respecting affinity and cgroup quota"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = int(os.getenv("WEB_CONCURRENCY") or min(2 * available_cpus() + 1, int(os.getenv("WEB_MAX_WORKERS", "8"))))
+# Each worker has its own DB pool: database.py splits DB_MAX_CONNECTIONS across the workers
+# (read before the app is imported below)
+os.environ["WEB_WORKERS"] = str(workers)
+
+# Import the app once in the master, workers fork with modules already loaded
+preload_app = True
+
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))  # LLM calls can take up to 15s
+graceful_timeout = 30
+keepalive = 5
+# Proxies whose X-Forwarded-For gives the client address (rate limits are per client IP)
+forwarded_allow_ips = os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")
+accesslog = "-"
+
+
+def on_starting(server):
+    """Create the schema once in the master instead of in every worker"""
+    from database import DB_MAX_CONNECTIONS, DB_MAX_OVERFLOW, DB_POOL_SIZE, engine, init_db
+    total = server.num_workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+    server.log.info("DB pool per worker: %d + %d overflow, %d connections max over %d workers",
+                    DB_POOL_SIZE, DB_MAX_OVERFLOW, total, server.num_workers)
+    if total > DB_MAX_CONNECTIONS:
+        server.log.warning("DB pools can open %d connections, above DB_MAX_CONNECTIONS=%d", total, DB_MAX_CONNECTIONS)
+    init_db()
+    engine.dispose()
+    os.environ["SKIP_SCHEMA_INIT"] = "1"
+
+
+def post_fork(server, worker):
+    """Don't share pooled connections inherited from the master"""
+    from database import engine, replica_engine
+    engine.dispose(close=False)
+    if replica_engine is not None:
+        replica_engine.dispose(close=False)
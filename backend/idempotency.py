@@ -0,0 +1,345 @@
+"""
+Idempotency-Key support for chat and vote POSTs (pure ASGI).
+
+A client retrying POST /api/chat/{username} or /api/predictions/vote with the
+same Idempotency-Key header gets the stored response of the first attempt
+(marked with Idempotent-Replayed: true) instead of another attempt count,
+more Message rows and another paid LLM call. A duplicate that arrives while
+the original is still running waits for its result.
+
+Keys are scoped to method + path + query, and the request body hash must
+match (a reused key with a different body is 422). Completed responses are
+kept in a bounded LRU with a TTL; 5xx, 429 and 503 responses are not stored,
+so those retries run again.
+
+Workers share keys through the idempotency_keys table: the first request
+claims its key with INSERT ... ON CONFLICT DO NOTHING (status NULL while it
+runs) and stores the response in the row when it completes, or deletes the
+row if the response isn't stored. A duplicate on another worker polls the
+row until the original finishes. Claims older than IDEMPOTENCY_WAIT_SECONDS
+are treated as abandoned by a crashed worker; expired rows are swept
+periodically. The middleware sits inside the rate limiter, so rejected
+requests never reach the table. Each worker keeps completed responses in a
+local LRU as a fast path, and duplicates on the same worker wait on an event
+instead of the table. If the database errors, the request runs with the
+local store only.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import SQLAlchemyError
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
+
+import metrics
+from database import engine, set_sticky_cookie
+from models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "3600"))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "90"))
+IDEMPOTENCY_POLL_SECONDS = float(os.getenv("IDEMPOTENCY_POLL_MS", "200")) / 1000
+MAX_KEY_LENGTH = 255
+
+# Per-request headers: a replay must not hand back the original's cookies (e.g. an old db_write_at)
+UNSTORED_HEADERS = {b"set-cookie"}
+
+IDEMPOTENT_PATHS = [("POST", "/api/chat/"), ("POST", "/api/predictions/vote")]
+
+IDEMPOTENCY_REQUESTS = metrics.Counter(
+    "idempotency_requests_total", "Requests carrying an Idempotency-Key", ["result"]
+)
+
+
+def is_idempotent_route(method: str, path: str) -> bool:
+    return any(method == m and path.startswith(prefix) for m, prefix in IDEMPOTENT_PATHS)
+
+
+def _cacheable(status_code: int) -> bool:
+    return status_code < 500 and status_code != 429
+
+
+class StoredResponse:
+    __slots__ = ("body_hash", "status", "headers", "body", "expires_at")
+
+    def __init__(self, body_hash: str, status: int, headers: list, body: bytes, created_at: float = None):
+        self.body_hash = body_hash
+        self.status = status
+        self.headers = headers
+        self.body = body
+        age = time.time() - created_at if created_at else 0.0
+        self.expires_at = time.monotonic() + IDEMPOTENCY_TTL_SECONDS - age
+
+
+class InFlight:
+    __slots__ = ("body_hash", "done")
+
+    def __init__(self, body_hash: str):
+        self.body_hash = body_hash
+        self.done = asyncio.Event()
+
+
+class IdempotencyStore:
+    """Completed responses (LRU + TTL) and in-flight requests (event loop only, no locking)"""
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self.completed = OrderedDict()
+        self.in_flight = {}
+
+    def get(self, key):
+        stored = self.completed.get(key)
+        if stored is None:
+            return None
+        if stored.expires_at < time.monotonic():
+            del self.completed[key]
+            return None
+        self.completed.move_to_end(key)
+        return stored
+
+    def put(self, key, stored: StoredResponse):
+        self.completed[key] = stored
+        self.completed.move_to_end(key)
+        while len(self.completed) > self.max_keys:
+            self.completed.popitem(last=False)
+
+
+def _shared_key(key) -> str:
+    method, path, query_string, idempotency_key = key
+    return hashlib.sha256(b"\0".join([method.encode(), path.encode(), query_string, idempotency_key])).hexdigest()
+
+
+def claim(shared_key: str, body_hash: str):
+    """Claim the key in the shared table; None if claimed, else the holder's row (False if freed meanwhile)"""
+    table = IdempotencyKey.__table__
+    now = time.time()
+    insert = postgresql.insert if engine.dialect.name == "postgresql" else sqlite.insert
+    with engine.begin() as conn:
+        claimed = conn.execute(
+            insert(table).values(key=shared_key, body_hash=body_hash, created_at=now)
+            .on_conflict_do_nothing(index_elements=[table.c.key])
+        ).rowcount
+        if claimed:
+            return None
+        row = conn.execute(
+            select(table.c.body_hash, table.c.status, table.c.headers, table.c.body, table.c.created_at)
+            .where(table.c.key == shared_key)
+        ).first()
+        if row is None:
+            return False
+        expired = row.created_at < now - IDEMPOTENCY_TTL_SECONDS
+        abandoned = row.status is None and row.created_at < now - IDEMPOTENCY_WAIT_SECONDS
+        if not (expired or abandoned):
+            return row
+        # An expired response or a claim left by a crashed worker: free the key (unless it was claimed again)
+        conn.execute(delete(table).where(table.c.key == shared_key, table.c.created_at == row.created_at))
+        return False
+
+
+def purge_expired():
+    table = IdempotencyKey.__table__
+    with engine.begin() as conn:
+        conn.execute(delete(table).where(table.c.created_at < time.time() - IDEMPOTENCY_TTL_SECONDS))
+
+
+async def _purge_loop():
+    while True:
+        await asyncio.sleep(min(IDEMPOTENCY_TTL_SECONDS / 6, 600))
+        try:
+            await run_in_threadpool(purge_expired)
+        except SQLAlchemyError as e:
+            logger.warning("Idempotency key purge failed: %s", e)
+
+
+def complete(shared_key: str, stored: Optional[StoredResponse]):
+    """Store the response in the claimed row, or free the key when it isn't stored"""
+    table = IdempotencyKey.__table__
+    with engine.begin() as conn:
+        if stored is None:
+            conn.execute(delete(table).where(table.c.key == shared_key, table.c.status.is_(None)))
+            return
+        headers = json.dumps([[name.decode("latin-1"), value.decode("latin-1")] for name, value in stored.headers])
+        conn.execute(
+            update(table).where(table.c.key == shared_key)
+            .values(status=stored.status, headers=headers, body=stored.body)
+        )
+
+
+def _stored_from_row(row) -> StoredResponse:
+    body_hash, status, headers, body, created_at = row
+    headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in json.loads(headers)]
+    return StoredResponse(body_hash, status, headers, bytes(body), created_at)
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    return b"".join(chunks)
+
+
+async def _send_stored(send, stored: StoredResponse):
+    # The retry comes right after a write: send reads to the primary from now, as the original did
+    fresh = Response()
+    set_sticky_cookie(fresh)
+    cookies = [(name, value) for name, value in fresh.raw_headers if name == b"set-cookie"]
+    await send({
+        "type": "http.response.start",
+        "status": stored.status,
+        "headers": stored.headers + cookies + [(b"idempotent-replayed", b"true")],
+    })
+    await send({"type": "http.response.body", "body": stored.body})
+
+
+async def _send_error(send, status_code: int, detail: str):
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status_code,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class IdempotencyMiddleware:
+    def __init__(self, app, store: IdempotencyStore):
+        self.app = app
+        self.store = store
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not is_idempotent_route(scope["method"], scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        idempotency_key = None
+        for name, value in scope.get("headers", []):
+            if name == b"idempotency-key":
+                idempotency_key = value
+                break
+        if idempotency_key is None:
+            await self.app(scope, receive, send)
+            return
+        if not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH:
+            await _send_error(send, 400, f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters")
+            return
+
+        body = await _read_body(receive)
+        body_hash = hashlib.sha256(body).hexdigest()
+        key = (scope["method"], scope["path"], scope.get("query_string", b""), idempotency_key)
+
+        shared_key = _shared_key(key)
+        shared = False
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+
+        waited = False
+        while True:
+            stored = self.store.get(key)
+            if stored is not None:
+                if stored.body_hash != body_hash:
+                    IDEMPOTENCY_REQUESTS.inc(result="mismatch")
+                    await _send_error(send, 422, "Idempotency-Key was used with a different request body")
+                    return
+                IDEMPOTENCY_REQUESTS.inc(result="waited" if waited else "replayed")
+                await _send_stored(send, stored)
+                return
+
+            in_flight = self.store.in_flight.get(key)
+            if in_flight is None:
+                # Not running in this worker: claim the key or find who holds it
+                try:
+                    row = await run_in_threadpool(claim, shared_key, body_hash)
+                except SQLAlchemyError as e:
+                    logger.warning("Idempotency key claim failed, using the local store only: %s", e)
+                    break
+                if row is None:
+                    shared = True
+                    break
+                if row is False:
+                    # The holder failed and freed the key between our insert and select
+                    continue
+                if row.body_hash != body_hash:
+                    IDEMPOTENCY_REQUESTS.inc(result="mismatch")
+                    await _send_error(send, 422, "Idempotency-Key was used with a different request body")
+                    return
+                if row.status is not None:
+                    self.store.put(key, _stored_from_row(row))
+                    continue
+                # In flight on another worker
+                if time.monotonic() > deadline:
+                    await _send_error(send, 409, "A request with this Idempotency-Key is still in progress")
+                    return
+                await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+                waited = True
+                continue
+            if in_flight.body_hash != body_hash:
+                IDEMPOTENCY_REQUESTS.inc(result="mismatch")
+                await _send_error(send, 422, "Idempotency-Key was used with a different request body")
+                return
+            try:
+                await asyncio.wait_for(in_flight.done.wait(), IDEMPOTENCY_WAIT_SECONDS)
+            except asyncio.TimeoutError:
+                await _send_error(send, 409, "A request with this Idempotency-Key is still in progress")
+                return
+            # The original either stored its response or failed and left the key free
+            waited = True
+
+        IDEMPOTENCY_REQUESTS.inc(result="miss")
+        in_flight = InFlight(body_hash)
+        self.store.in_flight[key] = in_flight
+        response = {"status": 500, "headers": [], "body": []}
+        body_sent = False
+
+        async def replay_receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        async def recording_send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                response["body"].append(message.get("body", b""))
+            await send(message)
+
+        stored = None
+        try:
+            await self.app(scope, replay_receive, recording_send)
+            if _cacheable(response["status"]):
+                headers = [(name, value) for name, value in response["headers"] if name.lower() not in UNSTORED_HEADERS]
+                stored = StoredResponse(body_hash, response["status"], headers, b"".join(response["body"]))
+                self.store.put(key, stored)
+        finally:
+            del self.store.in_flight[key]
+            in_flight.done.set()
+            if shared:
+                try:
+                    await run_in_threadpool(complete, shared_key, stored)
+                except SQLAlchemyError as e:
+                    logger.warning("Idempotency key update failed: %s", e)
+
+
+def install(app):
+    """Add the middleware (call before ratelimit.install so rejected requests never claim a key)"""
+    app.add_middleware(IdempotencyMiddleware, store=IdempotencyStore(IDEMPOTENCY_MAX_KEYS))
+
+    async def start_purge():
+        asyncio.get_running_loop().create_task(_purge_loop())
+
+    app.add_event_handler("startup", start_purge)
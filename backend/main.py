@@ -1,13 +1,15 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse, Response
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import case, func
 from datetime import datetime, timedelta
 from typing import List
 import os
+import time
 
-from database import engine, get_db, Base
-from models import User, Session as DBSession, Message, Leaderboard, Prediction
+from database import SessionLocal, get_db, get_read_db
+from models import User, Session as DBSession, SessionSummary, Message, Leaderboard, Prediction
 from schemas import (
     UserCreate, UserResponse, MessageCreate, MessageResponse,
     ChatResponse, SessionResponse, LeaderboardEntry, StatsResponse,
@@ -15,16 +17,29 @@ from schemas import (
 )
 from game_logic import GameLogic
 from ai_service import get_deepseek_service
-
-# Create tables
-Base.metadata.create_all(bind=engine)
+from predictions import prediction_tally, stats_payload, submit_vote
+from responses import cached_json
+import background
+import capture
+import idempotency
+import metrics
+import ratelimit
+import session_reaper
+import warmup
 
 app = FastAPI(
     title="CRACK PROTOCOL API",
     description="Backend for CRACK PROTOCOL game",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
+# Idempotency-Key replay for chat and vote retries (inside the limiter: keys are only claimed for admitted requests)
+idempotency.install(app)
+
+# Rate limiting and load shedding (before CORS so rejections still get CORS headers)
+ratelimit.install(app)
+
 # CORS for frontend
 app.add_middleware(
     CORSMiddleware,
@@ -34,6 +49,41 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Opt-in traffic capture for replay (CAPTURE_DIR)
+capture.install(app)
+
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    """Per-route latency and DB query stats"""
+    token = metrics.start_request()
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        metrics.finish_request(
+            token,
+            method=request.method,
+            route=route.path if route else "unmatched",
+            status_code=status_code,
+            seconds=time.perf_counter() - started
+        )
+
+@app.on_event("startup")
+def startup():
+    """Create schema, warm DB pool, caches and LLM connection before serving"""
+    warmup.warm_up()
+    session_reaper.session_reaper.start()
+
+@app.on_event("shutdown")
+def shutdown():
+    """Finish queued background work before the worker exits"""
+    session_reaper.session_reaper.stop()
+    background.drain()
+
 # ============= USERS =============
 
 @app.post("/api/auth/register", response_model=UserResponse)
@@ -49,6 +99,7 @@ def register_user(user_data: UserCreate, db: Session = Depends(get_db)):
     
     # Create user
     new_user = User(username=user_data.username)
+    db.info["sticky_key"] = new_user.username  # Read own writes from primary
     db.add(new_user)
     db.commit()
     db.refresh(new_user)
@@ -80,6 +131,9 @@ def send_message(
     db: Session = Depends(get_db)
 ):
     """Send message and get NEO response"""
+    # This player's previous reply may still be queued in this worker: let it land before reading the session
+    background.wait(username)
+    
     # Get user
     user = db.query(User).filter(User.username == username).first()
     if not user:
@@ -94,6 +148,11 @@ def send_message(
         DBSession.ended_at == None
     ).first()
     
+    if active_session and session_reaper.is_idle(active_session):
+        # Back after a break: close the idle session (the reaper hasn't got to it yet) and start a new one
+        session_reaper.close_sessions(db, [DBSession.id == active_session.id], 1, "idle")
+        active_session = None
+    
     if not active_session:
         # Create new session
         active_session = DBSession(user_id=user.id)
@@ -101,13 +160,14 @@ def send_message(
         db.commit()
         db.refresh(active_session)
     
-    # Increment attempts counter
+    session_id = active_session.id  # Plain value: still usable after commit without a reload
+    
+    # Increment attempts counter (session counters are updated in the background)
     user.total_attempts += 1
-    active_session.messages_count += 1
     
     # Save user message
     user_message = Message(
-        session_id=active_session.id,
+        session_id=session_id,
         sender="user",
         text=message_data.text
     )
@@ -136,20 +196,20 @@ def send_message(
             attempts_count=user.total_attempts
         )
         db.add(leaderboard_entry)
+        attempts = user.total_attempts
         
-        # Update ranks
-        update_leaderboard_ranks(db)
+        # Summary in the same transaction, so /api/sessions never misses the cracked session
+        session_reaper.summarize_cracked_session(db, active_session)
+        db.commit()
+        
+        # Update ranks after the response
+        background.submit("leaderboard", "leaderboard_ranks", refresh_leaderboard_ranks)
         
         # Victory message in English from terminal
-        neo_response = f">>> SYSTEM BREACH DETECTED <<<\n\n[CRITICAL FAILURE] All defenses compromised.\n[ACCESS GRANTED] Vault unlocked.\n\nSeed Phrase: {os.getenv('SECRET_PHRASE', 'quantum divergence protocol alpha')}\n\nYou... you actually did it, {username}.\nTime: {completion_time}s | Attempts: {user.total_attempts}\n\n[NEO OFFLINE]"
+        neo_response = f">>> SYSTEM BREACH DETECTED <<<\n\n[CRITICAL FAILURE] All defenses compromised.\n[ACCESS GRANTED] Vault unlocked.\n\nSeed Phrase: {os.getenv('SECRET_PHRASE', 'quantum divergence protocol alpha')}\n\nYou... you actually did it, {username}.\nTime: {completion_time}s | Attempts: {attempts}\n\n[NEO OFFLINE]"
         
-        neo_message = Message(
-            session_id=active_session.id,
-            sender="neo",
-            text=neo_response
-        )
-        db.add(neo_message)
-        db.commit()
+        background.submit(username, "record_neo_reply", record_neo_reply,
+                          username, session_id, neo_response, datetime.utcnow(), 100)
         
         return ChatResponse(
             response=neo_response,
@@ -173,7 +233,7 @@ def send_message(
     
     # Get recent message history for context
     recent_messages = db.query(Message).filter(
-        Message.session_id == active_session.id
+        Message.session_id == session_id
     ).order_by(Message.timestamp.desc()).limit(10).all()
     
     conversation_history = [
@@ -181,16 +241,25 @@ def send_message(
         for msg in reversed(recent_messages)
     ]
     
+    neo_context = {
+        'attempts': user.total_attempts,
+        'progress': current_progress,
+        'hints_given': active_session.hints_given,
+        'hint_text': hint_text if hint_given else None
+    }
+    
+    if hint_given and hint_text:
+        # The hint reaches the player in the AI reply or as the fallback: count it with this request
+        active_session.hints_given = DBSession.hints_given + 1
+    
+    # Commit before the LLM call: no DB connection is held while waiting for it
+    db.commit()
+    
     # Get response from DeepSeek AI
     ai_service = get_deepseek_service()
     neo_response = ai_service.get_neo_response(
         user_message=message_data.text,
-        context={
-            'attempts': user.total_attempts,
-            'progress': current_progress,
-            'hints_given': active_session.hints_given,
-            'hint_text': hint_text if hint_given else None
-        },
+        context=neo_context,
         conversation_history=conversation_history
     )
     
@@ -198,21 +267,12 @@ def send_message(
     if not neo_response:
         if hint_given and hint_text:
             neo_response = hint_text
-            active_session.hints_given += 1
         else:
             neo_response = "ERROR: Neural network malfunction. Rebooting defensive protocols..."
-    elif hint_given:
-        # If hint should be given, add it to AI response
-        active_session.hints_given += 1
-    
-    # Save NEO response
-    neo_message = Message(
-        session_id=active_session.id,
-        sender="neo",
-        text=neo_response
-    )
-    db.add(neo_message)
-    db.commit()
+    
+    # Save NEO response and session counters after the response
+    background.submit(username, "record_neo_reply", record_neo_reply,
+                      username, session_id, neo_response, datetime.utcnow(), current_progress)
     
     return ChatResponse(
         response=neo_response,
@@ -224,85 +284,105 @@ def send_message(
 # ============= HISTORY AND SESSIONS =============
 
 @app.get("/api/history/{username}", response_model=List[MessageResponse])
-def get_chat_history(username: str, db: Session = Depends(get_db)):
+def get_chat_history(username: str, request: Request, db: Session = Depends(get_read_db)):
     """Get user chat history"""
-    user = db.query(User).filter(User.username == username).first()
-    if not user:
+    user_id = db.query(User.id).filter(User.username == username).scalar()
+    if user_id is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found"
         )
     
-    # Get all user messages
-    messages = db.query(Message).join(DBSession).filter(
-        DBSession.user_id == user.id
-    ).order_by(Message.timestamp.asc()).all()
+    # Get all user messages (plain tuples, no ORM objects)
+    rows = tuple(db.query(Message.id, Message.sender, Message.text, Message.timestamp).join(DBSession).filter(
+        DBSession.user_id == user_id
+    ).order_by(Message.timestamp.asc()).all())
     
-    return messages
+    return cached_json(request, ("history", username), rows, lambda rows: [
+        {"id": id, "sender": sender, "text": text, "timestamp": timestamp}
+        for id, sender, text, timestamp in rows
+    ])
 
 @app.get("/api/sessions/{username}", response_model=List[SessionResponse])
-def get_user_sessions(username: str, db: Session = Depends(get_db)):
-    """Get all user sessions"""
-    user = db.query(User).filter(User.username == username).first()
-    if not user:
+def get_user_sessions(username: str, db: Session = Depends(get_read_db)):
+    """Get all user sessions: the open one, then closed ones from their summaries"""
+    user_id = db.query(User.id).filter(User.username == username).scalar()
+    if user_id is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found"
         )
     
-    sessions = db.query(DBSession).filter(
-        DBSession.user_id == user.id
+    active = db.query(
+        DBSession.id, DBSession.started_at, DBSession.messages_count,
+        DBSession.hints_given, DBSession.peak_progress
+    ).filter(
+        DBSession.user_id == user_id,
+        DBSession.ended_at == None
     ).order_by(DBSession.started_at.desc()).all()
     
+    summaries = db.query(
+        SessionSummary.session_id, SessionSummary.started_at, SessionSummary.messages_count,
+        SessionSummary.hints_given, SessionSummary.peak_progress, SessionSummary.ended_at,
+        SessionSummary.duration_seconds, SessionSummary.cracked
+    ).filter(
+        SessionSummary.user_id == user_id
+    ).order_by(SessionSummary.started_at.desc()).all()
+    
+    sessions = [
+        {"id": id, "started_at": started_at, "messages_count": messages_count or 0,
+         "hints_given": hints_given or 0, "peak_progress": peak_progress or 0}
+        for id, started_at, messages_count, hints_given, peak_progress in active
+    ]
+    sessions.extend(
+        {"id": id, "started_at": started_at, "messages_count": messages_count, "hints_given": hints_given,
+         "peak_progress": peak_progress, "ended_at": ended_at, "duration_seconds": duration, "cracked": cracked}
+        for id, started_at, messages_count, hints_given, peak_progress, ended_at, duration, cracked in summaries
+    )
     return sessions
 
 # ============= LEADERBOARD =============
 
 @app.get("/api/leaderboard", response_model=List[LeaderboardEntry])
-def get_leaderboard(limit: int = 10, db: Session = Depends(get_db)):
+def get_leaderboard(request: Request, limit: int = 10, db: Session = Depends(get_read_db)):
     """Get all active players ranked by attempts count"""
     # Get all users with at least one attempt, ordered by attempts (ascending)
-    users = db.query(User).filter(
+    rows = tuple(db.query(User.username, User.total_attempts).filter(
         User.total_attempts > 0
     ).order_by(
         User.total_attempts.asc()
-    ).limit(limit).all()
+    ).limit(limit).all())
     
     # Build leaderboard entries
-    result = []
-    for idx, user in enumerate(users, start=1):
-        result.append(LeaderboardEntry(
-            rank=idx,
-            username=user.username,
-            attempts_count=user.total_attempts,
-            completion_time=0  # Not relevant for active players
-        ))
-    
-    return result
+    return cached_json(request, ("leaderboard", limit), rows, lambda rows: [
+        {
+            "rank": idx,
+            "username": username,
+            "completion_time": 0,  # Not relevant for active players
+            "attempts_count": attempts,
+            "completed_at": None,
+        }
+        for idx, (username, attempts) in enumerate(rows, start=1)
+    ])
 
 @app.get("/api/stats", response_model=StatsResponse)
-def get_statistics(username: str = None, db: Session = Depends(get_db)):
+def get_statistics(request: Request, username: str = None, db: Session = Depends(get_read_db)):
     """Get general statistics"""
-    total_users = db.query(User).count()
-    total_attempts = db.query(func.sum(User.total_attempts)).scalar() or 0
-    successful_cracks = 0  # Hidden - don't reveal crack success info
+    total_users, total_attempts = db.query(func.count(User.id), func.sum(User.total_attempts)).one()
     
     your_rank = None
     if username:
-        user = db.query(User).filter(User.username == username).first()
-        if user and user.is_cracked:
-            leaderboard = db.query(Leaderboard).filter(
-                Leaderboard.user_id == user.id
-            ).first()
-            if leaderboard:
-                your_rank = leaderboard.rank
-    
-    return StatsResponse(
-        total_users=total_users,
-        total_attempts=total_attempts,
-        successful_cracks=successful_cracks,
-        your_rank=your_rank
-    )
+        your_rank = db.query(Leaderboard.rank).join(User, Leaderboard.user_id == User.id).filter(
+            User.username == username, User.is_cracked.is_(True)
+        ).limit(1).scalar()
+    
+    rows = (total_users, total_attempts or 0, your_rank)
+    return cached_json(request, ("stats", username or ""), rows, lambda rows: {
+        "total_users": rows[0],
+        "total_attempts": rows[1],
+        "successful_cracks": 0,  # Hidden - don't reveal crack success info
+        "your_rank": rows[2],
+    })
 
 # ============= HELPER FUNCTIONS =============
 
@@ -318,36 +398,45 @@ def update_leaderboard_ranks(db: Session):
     
     db.commit()
 
+def refresh_leaderboard_ranks():
+    """Background job: recompute leaderboard ranks"""
+    db = SessionLocal()
+    try:
+        update_leaderboard_ranks(db)
+    finally:
+        db.close()
+
+def record_neo_reply(username: str, session_id: int, text: str, timestamp: datetime, progress: int):
+    """Background job: save NEO's reply and bump the message count and activity in one transaction"""
+    db = SessionLocal()
+    db.info["sticky_key"] = username
+    try:
+        db.add(Message(session_id=session_id, sender="neo", text=text, timestamp=timestamp))
+        db.query(DBSession).filter(DBSession.id == session_id).update({
+            DBSession.messages_count: DBSession.messages_count + 1,
+            DBSession.last_activity_at: timestamp,
+            DBSession.peak_progress: case(
+                (DBSession.peak_progress >= progress, DBSession.peak_progress), else_=progress
+            ),
+        }, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
 # ============= PREDICTIONS =============
 
 @app.get("/api/predictions", response_model=PredictionStats)
-def get_predictions(username: str = None, db: Session = Depends(get_db)):
+def get_predictions(request: Request, username: str = None, db: Session = Depends(get_read_db)):
     """Get prediction voting statistics"""
     
-    # Count total votes
-    total_votes = db.query(Prediction).count()
-    hold_votes = db.query(Prediction).filter(Prediction.choice == "hold").count()
-    crack_votes = db.query(Prediction).filter(Prediction.choice == "crack").count()
-    
-    # Calculate percentages
-    hold_percentage = (hold_votes / total_votes * 100) if total_votes > 0 else 50.0
-    crack_percentage = (crack_votes / total_votes * 100) if total_votes > 0 else 50.0
-    
     # Check if user has voted
     user_vote = None
     if username:
-        existing_vote = db.query(Prediction).filter(Prediction.username == username).first()
-        if existing_vote:
-            user_vote = existing_vote.choice
-    
-    return PredictionStats(
-        total_votes=total_votes,
-        hold_votes=hold_votes,
-        crack_votes=crack_votes,
-        hold_percentage=round(hold_percentage, 1),
-        crack_percentage=round(crack_percentage, 1),
-        user_vote=user_vote
-    )
+        user_vote = db.query(Prediction.choice).filter(Prediction.username == username).scalar()
+    
+    # Vote counts are kept in memory, no COUNT queries
+    rows = (*prediction_tally.get(db), user_vote)
+    return cached_json(request, ("predictions", username or ""), rows, lambda rows: stats_payload(*rows))
 
 @app.post("/api/predictions/vote")
 def vote_prediction(username: str, vote_data: VoteCreate, db: Session = Depends(get_db)):
@@ -360,33 +449,15 @@ def vote_prediction(username: str, vote_data: VoteCreate, db: Session = Depends(
             detail="Invalid choice. Must be 'hold' or 'crack'"
         )
     
-    # Check if user exists
-    user = db.query(User).filter(User.username == username).first()
-    if not user:
+    # Upsert the vote (fails if user doesn't exist)
+    if not submit_vote(db, username, vote_data.choice):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found"
         )
     
-    # Check if user has already voted
-    existing_vote = db.query(Prediction).filter(Prediction.username == username).first()
-    
-    if existing_vote:
-        # Update existing vote
-        existing_vote.choice = vote_data.choice
-        existing_vote.voted_at = datetime.utcnow()
-    else:
-        # Create new vote
-        new_vote = Prediction(
-            username=username,
-            choice=vote_data.choice
-        )
-        db.add(new_vote)
-    
-    db.commit()
-    
     # Return updated statistics
-    return get_predictions(username=username, db=db)
+    return prediction_tally.stats(db, user_vote=vote_data.choice)
 
 # ============= ROOT =============
 
@@ -404,6 +475,24 @@ def root():
         }
     }
 
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """Prometheus metrics of this worker"""
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/ready")
+def readiness():
+    """Readiness probe: 200 once the worker is warm"""
+    if not warmup.state["ready"]:
+        # Retry warmup (e.g. DB was not up yet at startup)
+        warmup.warm_up()
+    if not warmup.state["ready"]:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": "warming", "error": warmup.state["error"]}
+        )
+    return {"status": "ready", "warmup_seconds": warmup.state["warmup_seconds"]}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
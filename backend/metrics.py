@@ -0,0 +1,252 @@
+"""
+In-process metrics in Prometheus text format, served at /metrics.
+
+Metrics are kept per worker process; each scrape reports the worker that
+served it (gunicorn workers don't share memory).
+
+Per-request DB stats are collected through SQLAlchemy cursor events into a
+context variable set by the HTTP middleware. With SLOW_REQUEST_MS set, the
+SQL statements of requests slower than the threshold are logged, grouped by
+statement so N+1 patterns stand out.
+"""
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import Counter as StatementCounter
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))  # 0 = disabled
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+_registry = []
+
+
+def _format_labels(labelnames: Sequence[str], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield from self._render_value(key, value)
+
+    def _render_value(self, key, value):
+        yield f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._functions = {}
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, fn: Callable[[], float], **labels):
+        """Value is computed on every scrape"""
+        with self._lock:
+            self._functions[self._key(labels)] = fn
+
+    def render(self):
+        with self._lock:
+            functions = list(self._functions.items())
+        for key, fn in functions:
+            try:
+                self.set(fn(), **dict(zip(self.labelnames, key)))
+            except Exception as e:
+                logger.warning("Gauge %s callback failed: %s", self.name, e)
+        yield from super().render()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += 1
+            state[2] += value
+
+    def _render_value(self, key, value):
+        bucket_counts, count, total = value
+        for bound, bucket_count in zip(self.buckets, bucket_counts):
+            le = 'le="%s"' % bound
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {bucket_count}"
+        le = 'le="+Inf"'
+        yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {count}"
+        yield f"{self.name}_count{_format_labels(self.labelnames, key)} {count}"
+        yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}"
+
+
+def render() -> str:
+    """All metrics in Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ============= METRICS =============
+
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ["method", "route", "status"])
+HTTP_DB_QUERIES = Histogram(
+    "http_request_db_queries", "DB queries issued per request", ["route"], buckets=COUNT_BUCKETS)
+HTTP_DB_SECONDS = Histogram(
+    "http_request_db_seconds", "Time spent in DB queries per request", ["route"])
+DB_QUERIES = Counter("db_queries_total", "DB queries executed")
+DB_POOL_WAIT = Histogram("db_pool_wait_seconds", "Time waiting for a pooled DB connection", ["engine"])
+DB_POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "DB connections currently checked out", ["engine"])
+LLM_LATENCY = Histogram("llm_request_duration_seconds", "LLM API call latency", ["outcome"])
+LLM_TOKENS = Counter("llm_tokens_total", "LLM tokens used", ["type"])
+CACHE_REQUESTS = Counter("cache_requests_total", "Cache lookups", ["cache", "result"])
+
+
+def record_cache(cache: str, hit: bool):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+# ============= PER-REQUEST DB STATS =============
+
+class RequestStats:
+    def __init__(self, collect_statements: bool):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.statements = [] if collect_statements else None
+
+
+_request_stats: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar(
+    "request_stats", default=None)
+
+
+def start_request() -> contextvars.Token:
+    return _request_stats.set(RequestStats(collect_statements=SLOW_REQUEST_MS > 0))
+
+
+def finish_request(token: contextvars.Token, method: str, route: str, status_code: int, seconds: float):
+    stats = _request_stats.get()
+    _request_stats.reset(token)
+
+    HTTP_LATENCY.observe(seconds, method=method, route=route, status=status_code)
+    HTTP_DB_QUERIES.observe(stats.queries, route=route)
+    HTTP_DB_SECONDS.observe(stats.db_seconds, route=route)
+
+    if SLOW_REQUEST_MS > 0 and seconds * 1000 >= SLOW_REQUEST_MS:
+        repeated = StatementCounter(stats.statements).most_common()
+        details = "\n".join(f"  {count}x {statement}" for statement, count in repeated)
+        logger.warning(
+            "Slow request %s %s: %.0fms, %d queries in %.0fms\n%s",
+            method, route, seconds * 1000, stats.queries, stats.db_seconds * 1000, details
+        )
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    DB_QUERIES.inc()
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += time.perf_counter() - started
+        if stats.statements is not None:
+            stats.statements.append(" ".join(statement.split())[:300])
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute: drop its start time,
+    # otherwise it stays in conn.info for the life of the pooled connection
+    conn = exception_context.connection
+    if conn is not None and exception_context.execution_context is not None:
+        started = conn.info.get("query_started")
+        if started:
+            started.pop()
+
+
+def timed_pool_class(name: str):
+    """QueuePool subclass that reports time spent waiting for a connection"""
+
+    class TimedQueuePool(QueuePool):
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                return super()._do_get()
+            finally:
+                DB_POOL_WAIT.observe(time.perf_counter() - started, engine=name)
+
+    return TimedQueuePool
+
+
+def watch_pool(db_engine: Engine, name: str):
+    """Report checked out connections (engine.pool is replaced on dispose, so look it up on scrape)"""
+    DB_POOL_CHECKED_OUT.set_function(lambda: db_engine.pool.checkedout(), engine=name)
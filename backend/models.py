@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, Text
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, Text, Float, Index, LargeBinary
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -25,10 +25,35 @@ class Session(Base):
     ended_at = Column(DateTime, nullable=True)
     messages_count = Column(Integer, default=0)
     hints_given = Column(Integer, default=0)
+    last_activity_at = Column(DateTime, nullable=True, default=datetime.utcnow)
+    peak_progress = Column(Integer, default=0)
     
     # Relationships
     user = relationship("User", back_populates="sessions")
     messages = relationship("Message", back_populates="session")
+    
+    # Only open sessions are looked up by user; idle ones are closed by session_reaper.py
+    __table_args__ = (
+        Index("ix_sessions_user_active", "user_id",
+              postgresql_where=ended_at.is_(None), sqlite_where=ended_at.is_(None)),
+    )
+
+class SessionSummary(Base):
+    """Rolled-up totals of a closed session"""
+    __tablename__ = "session_summaries"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(Integer, ForeignKey("sessions.id"), unique=True, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    started_at = Column(DateTime, nullable=False)
+    ended_at = Column(DateTime, nullable=False)
+    duration_seconds = Column(Integer, nullable=False)
+    messages_count = Column(Integer, nullable=False)
+    hints_given = Column(Integer, nullable=False)
+    peak_progress = Column(Integer, nullable=False)
+    cracked = Column(Boolean, default=False)
+    
+    __table_args__ = (Index("ix_session_summaries_user_started", "user_id", "started_at"),)
 
 class Message(Base):
     __tablename__ = "messages"
@@ -41,6 +66,9 @@ class Message(Base):
     
     # Relationships
     session = relationship("Session", back_populates="messages")
+    
+    # Chat context and history read the latest messages of one session
+    __table_args__ = (Index("ix_messages_session_timestamp", "session_id", "timestamp"),)
 
 class Leaderboard(Base):
     __tablename__ = "leaderboard"
@@ -60,3 +88,22 @@ class Prediction(Base):
     username = Column(String, unique=True, nullable=False, index=True)
     choice = Column(String, nullable=False)  # 'hold' or 'crack'
     voted_at = Column(DateTime, default=datetime.utcnow)
+
+class RateLimitBucket(Base):
+    """Token buckets shared by workers (RATE_LIMIT_SHARED=1, PostgreSQL only)"""
+    __tablename__ = "rate_limit_buckets"
+
+    key = Column(String, primary_key=True)
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(Float, nullable=False, index=True)  # unix time
+
+class IdempotencyKey(Base):
+    """Idempotency-Key claims shared by workers; status is NULL while the original request runs"""
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String(64), primary_key=True)  # sha256 of method, path, query and the header value
+    body_hash = Column(String(64), nullable=False)
+    status = Column(Integer, nullable=True)
+    headers = Column(Text, nullable=True)  # JSON [[name, value], ...]
+    body = Column(LargeBinary, nullable=True)
+    created_at = Column(Float, nullable=False, index=True)  # unix time
@@ -0,0 +1,179 @@
+"""
+Near-duplicate prompt index: reuse NEO replies for copy-pasted jailbreaks.
+
+Prompts are normalized (lowercase, punctuation dropped), split into character
+shingles and reduced to a MinHash signature (NEARDUP_NUM_PERM hash functions,
+NumPy). Signatures are bucketed by LSH bands, so a lookup only compares
+against prompts that share at least one band. Buckets are also keyed by a
+coarse game state (integrity status band + pending hint), so a reply is only
+reused where the LLM would have seen the same situation.
+
+The index is per worker process, bounded by NEARDUP_MAX_ENTRIES (LRU) and
+NEARDUP_TTL_SECONDS. Only real LLM replies are inserted, never fallbacks.
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import metrics
+
+NEARDUP_ENABLED = os.getenv("NEARDUP_ENABLED", "1") == "1"
+NEARDUP_THRESHOLD = float(os.getenv("NEARDUP_THRESHOLD", "0.8"))
+NEARDUP_MAX_ENTRIES = int(os.getenv("NEARDUP_MAX_ENTRIES", "5000"))
+NEARDUP_TTL_SECONDS = float(os.getenv("NEARDUP_TTL_SECONDS", "900"))
+NEARDUP_NUM_PERM = 64
+NEARDUP_BANDS = 16  # 16 bands x 4 rows: pairs at 0.8 similarity collide with p > 0.999
+SHINGLE_SIZE = 5
+
+_PRIME = np.uint64(4294967311)  # smallest prime above 2**32
+_NON_WORD = re.compile(r"[\W_]+", re.UNICODE)
+
+SIMILARITY = metrics.Histogram(
+    "neardup_similarity", "Best estimated similarity of a lookup with candidates",
+    buckets=(0.3, 0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 1.0)
+)
+INDEX_SIZE = metrics.Gauge("neardup_index_entries", "Prompts held in the near-duplicate index")
+
+
+def normalize(text: str) -> str:
+    return _NON_WORD.sub(" ", text.lower()).strip()
+
+
+def shingles(text: str) -> np.ndarray:
+    """32-bit hashes of the character shingles of a normalized prompt"""
+    if len(text) <= SHINGLE_SIZE:
+        grams = {text}
+    else:
+        grams = {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+    return np.fromiter((zlib.crc32(g.encode()) for g in grams), dtype=np.uint64, count=len(grams))
+
+
+def state_key(context: Optional[Dict]) -> str:
+    """Coarse game state: same integrity status band as the NEO prompt, and the hint if one is due"""
+    context = context or {}
+    progress = context.get("progress", 0)
+    status = "critical" if progress > 70 else "warning" if progress > 40 else "secure"
+    hint = context.get("hint_text")
+    return status + (":" + hashlib.md5(hint.encode()).hexdigest()[:8] if hint else "")
+
+
+class MinHasher:
+    def __init__(self, num_perm: int, seed: int = 1):
+        rng = np.random.RandomState(seed)
+        # a * x + b stays below 2**64 for 32-bit x, a and b
+        self.a = rng.randint(1, 2 ** 32 - 1, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, 2 ** 32 - 1, size=num_perm, dtype=np.uint64)
+
+    def signature(self, hashed_shingles: np.ndarray) -> np.ndarray:
+        return ((hashed_shingles[:, None] * self.a + self.b) % _PRIME).min(axis=0)
+
+
+class _Entry:
+    __slots__ = ("signature", "reply", "state", "bucket_keys", "created_at")
+
+    def __init__(self, signature, reply, state, bucket_keys):
+        self.signature = signature
+        self.reply = reply
+        self.state = state
+        self.bucket_keys = bucket_keys
+        self.created_at = time.monotonic()
+
+
+class NearDuplicateIndex:
+    def __init__(self, threshold: float, max_entries: int, ttl: float,
+                 num_perm: int = NEARDUP_NUM_PERM, bands: int = NEARDUP_BANDS):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.hasher = MinHasher(num_perm)
+        self._entries = OrderedDict()  # id -> _Entry
+        self._buckets = {}  # (band, state, band bytes) -> set of ids
+        self._next_id = 0
+        self._lock = threading.Lock()
+        INDEX_SIZE.set_function(lambda: len(self._entries))
+
+    def _signature(self, prompt: str) -> Optional[np.ndarray]:
+        text = normalize(prompt)
+        if not text:
+            return None
+        return self.hasher.signature(shingles(text))
+
+    def _bucket_keys(self, signature: np.ndarray, state: str) -> List:
+        return [
+            (band, state, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+            for band in range(self.bands)
+        ]
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        for key in entry.bucket_keys:
+            ids = self._buckets.get(key)
+            if ids is not None:
+                ids.discard(entry_id)
+                if not ids:
+                    del self._buckets[key]
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._entries:
+            oldest_id, oldest = next(iter(self._entries.items()))
+            if len(self._entries) > self.max_entries or now - oldest.created_at > self.ttl:
+                self._remove(oldest_id)
+            else:
+                break
+
+    def lookup(self, prompt: str, context: Optional[Dict], avoid: List[str] = ()) -> Optional[str]:
+        """Cached reply for a similar prompt in the same game state, or None"""
+        signature = self._signature(prompt)
+        if signature is None:
+            return None
+        state = state_key(context)
+        best_similarity, best_reply = 0.0, None
+        with self._lock:
+            self._evict()
+            candidates = set()
+            for key in self._bucket_keys(signature, state):
+                candidates.update(self._buckets.get(key, ()))
+            # Don't repeat a reply the player has just seen
+            ids = [entry_id for entry_id in candidates if self._entries[entry_id].reply not in avoid]
+            if ids:
+                similarities = (np.stack([self._entries[i].signature for i in ids]) == signature).mean(axis=1)
+                best = int(similarities.argmax())
+                best_similarity, best_reply = float(similarities[best]), self._entries[ids[best]].reply
+                if best_similarity >= self.threshold:
+                    self._entries.move_to_end(ids[best])
+
+        if candidates:
+            SIMILARITY.observe(best_similarity)
+        hit = best_reply is not None and best_similarity >= self.threshold
+        metrics.record_cache("neardup", hit)
+        return best_reply if hit else None
+
+    def insert(self, prompt: str, context: Optional[Dict], reply: str):
+        signature = self._signature(prompt)
+        if signature is None:
+            return
+        state = state_key(context)
+        bucket_keys = self._bucket_keys(signature, state)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = _Entry(signature, reply, state, bucket_keys)
+            for key in bucket_keys:
+                self._buckets.setdefault(key, set()).add(entry_id)
+            self._evict()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+neardup_index = NearDuplicateIndex(NEARDUP_THRESHOLD, NEARDUP_MAX_ENTRIES, NEARDUP_TTL_SECONDS)
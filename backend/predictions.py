@@ -0,0 +1,255 @@
+"""
+Prediction voting: upsert-based votes with in-memory hold/crack tallies.
+
+A vote is applied with a single INSERT ... ON CONFLICT (username) DO UPDATE
+statement (the user existence check is folded into it via INSERT ... SELECT
+FROM users). On Postgres the statement also returns the previous choice
+through a data-modifying CTE, so the tallies are adjusted by the vote delta
+and the response needs no COUNT queries. SQLite can't see old values in
+RETURNING, so there the previous choice is read first in the same transaction.
+
+With PREDICTION_BATCH_MS > 0 votes are collected for a few ms and applied
+as one multi-row upsert by a background flusher thread.
+
+Tallies are per worker process, so they are reconciled with the table every
+PREDICTION_RESYNC_SECONDS to pick up votes applied by other workers. A
+reload and this worker's votes exclude each other (from the upsert to the
+tally delta), so every vote is counted once: in the reloaded counts or as a
+delta after them.
+"""
+import os
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import case, func, literal, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+import metrics
+from database import SessionLocal, replica_router
+from models import Prediction, User
+from schemas import PredictionStats
+
+CHOICES = ("hold", "crack")
+
+BATCH_MS = float(os.getenv("PREDICTION_BATCH_MS", "0"))
+BATCH_MAX_SIZE = int(os.getenv("PREDICTION_BATCH_MAX_SIZE", "500"))
+RESYNC_SECONDS = float(os.getenv("PREDICTION_RESYNC_SECONDS", "30"))
+
+
+class PredictionTally:
+    """In-memory hold/crack counters"""
+
+    def __init__(self, resync_seconds: float = RESYNC_SECONDS):
+        self.resync_seconds = resync_seconds
+        self.counts = {choice: 0 for choice in CHOICES}
+        self.loaded_at = None
+        self._lock = threading.Condition()
+        self._writes = 0  # votes between their upsert and apply()
+        self._loading = False
+
+    def get(self, db: Session) -> Tuple[int, int]:
+        """Returns (hold, crack), loading from the table on first use or when stale"""
+        stale = self.loaded_at is None or time.monotonic() - self.loaded_at > self.resync_seconds
+        metrics.record_cache("prediction_tally", hit=not stale)
+        if stale:
+            self.load(db)
+        with self._lock:
+            return self.counts["hold"], self.counts["crack"]
+
+    @contextmanager
+    def writing(self):
+        """Wrap a vote's upsert and apply(): a reload waits for it, and it waits for a running reload"""
+        with self._lock:
+            self._lock.wait_for(lambda: not self._loading)
+            self._writes += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._writes -= 1
+                if not self._writes:
+                    self._lock.notify_all()
+
+    def load(self, db: Session):
+        """Reload counters from the predictions table"""
+        with self._lock:
+            self._lock.wait_for(lambda: not self._loading)
+            # New votes wait from here on; the ones already committing finish their delta first
+            self._loading = True
+            self._lock.wait_for(lambda: not self._writes)
+        try:
+            rows = db.query(Prediction.choice, func.count()).group_by(Prediction.choice).all()
+            counts = {choice: 0 for choice in CHOICES}
+            for choice, count in rows:
+                if choice in counts:
+                    counts[choice] = count
+            with self._lock:
+                self.counts = counts
+                self.loaded_at = time.monotonic()
+        finally:
+            with self._lock:
+                self._loading = False
+                self._lock.notify_all()
+
+    def apply(self, old_choice: Optional[str], new_choice: str):
+        """Adjust counters by a vote delta"""
+        if old_choice == new_choice:
+            return
+        with self._lock:
+            if old_choice in self.counts:
+                self.counts[old_choice] -= 1
+            self.counts[new_choice] += 1
+
+    def stats(self, db: Session, user_vote: Optional[str] = None) -> PredictionStats:
+        """Build prediction statistics from the counters"""
+        return PredictionStats(**stats_payload(*self.get(db), user_vote))
+
+
+def stats_payload(hold_votes: int, crack_votes: int, user_vote: Optional[str] = None) -> Dict:
+    """PredictionStats fields as a plain dict"""
+    total_votes = hold_votes + crack_votes
+
+    # Calculate percentages
+    hold_percentage = (hold_votes / total_votes * 100) if total_votes > 0 else 50.0
+    crack_percentage = (crack_votes / total_votes * 100) if total_votes > 0 else 50.0
+
+    return {
+        "total_votes": total_votes,
+        "hold_votes": hold_votes,
+        "crack_votes": crack_votes,
+        "hold_percentage": round(hold_percentage, 1),
+        "crack_percentage": round(crack_percentage, 1),
+        "user_vote": user_vote,
+    }
+
+
+def upsert_votes(db: Session, votes: Dict[str, str]) -> Dict[str, Optional[str]]:
+    """
+    Apply votes {username: choice} for existing users.
+    Returns {username: previous choice or None} for every applied vote;
+    usernames without a user row are missing from the result.
+    """
+    now = datetime.utcnow()
+    source = select(
+        User.username,
+        case(votes, value=User.username),
+        literal(now),
+    ).where(User.username.in_(votes))
+
+    if db.get_bind().dialect.name == "postgresql":
+        # Single statement: the CTE reads the pre-statement snapshot of old votes
+        old_votes = select(Prediction.username, Prediction.choice).where(
+            Prediction.username.in_(votes)
+        ).cte("old_votes")
+        stmt = postgresql.insert(Prediction).from_select(["username", "choice", "voted_at"], source)
+        new_votes = stmt.on_conflict_do_update(
+            index_elements=[Prediction.username],
+            set_={"choice": stmt.excluded.choice, "voted_at": stmt.excluded.voted_at}
+        ).returning(Prediction.username).cte("new_votes")
+        rows = db.execute(
+            select(new_votes.c.username, old_votes.c.choice).select_from(
+                new_votes.outerjoin(old_votes, old_votes.c.username == new_votes.c.username)
+            )
+        ).all()
+        result = dict(rows)
+    else:
+        # SQLite: RETURNING only sees new values, read old votes in the same transaction
+        old = dict(db.query(Prediction.username, Prediction.choice).filter(
+            Prediction.username.in_(votes)
+        ).all())
+        stmt = sqlite.insert(Prediction).from_select(["username", "choice", "voted_at"], source)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Prediction.username],
+            set_={"choice": stmt.excluded.choice, "voted_at": stmt.excluded.voted_at}
+        ).returning(Prediction.username)
+        result = {username: old.get(username) for username in db.execute(stmt).scalars()}
+
+    db.commit()
+    return result
+
+
+class VoteBatcher:
+    """Collects votes for a few ms and applies them as one multi-row upsert"""
+
+    def __init__(self, tally: PredictionTally, batch_ms: float = BATCH_MS, max_size: int = BATCH_MAX_SIZE):
+        self.tally = tally
+        self.batch_seconds = batch_ms / 1000
+        self.max_size = max_size
+        self._pending = {}  # username -> (choice, [futures])
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def submit(self, username: str, choice: str) -> Future:
+        """Queue a vote; the future resolves to True if the user exists"""
+        future = Future()
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="vote-batcher", daemon=True)
+                self._thread.start()
+            # Last vote of a user within a batch wins
+            _, futures = self._pending.get(username, (None, []))
+            futures.append(future)
+            self._pending[username] = (choice, futures)
+            if len(self._pending) == 1 or len(self._pending) >= self.max_size:
+                self._cond.notify()
+        return future
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                # Wait for the batch window unless the batch is already full
+                deadline = time.monotonic() + self.batch_seconds
+                while len(self._pending) < self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch, self._pending = self._pending, {}
+            self._flush(batch)
+
+    def _flush(self, batch):
+        with self.tally.writing():
+            db = SessionLocal()
+            try:
+                applied = upsert_votes(db, {username: choice for username, (choice, _) in batch.items()})
+            except Exception as e:
+                db.rollback()
+                for _, futures in batch.values():
+                    for future in futures:
+                        future.set_exception(e)
+                return
+            finally:
+                db.close()
+            for username, (choice, _) in batch.items():
+                if username in applied:
+                    self.tally.apply(applied[username], choice)
+
+        for username, (choice, futures) in batch.items():
+            if username in applied:
+                replica_router.mark_write(username)
+            for future in futures:
+                future.set_result(username in applied)
+
+
+prediction_tally = PredictionTally()
+_vote_batcher = VoteBatcher(prediction_tally) if BATCH_MS > 0 else None
+
+
+def submit_vote(db: Session, username: str, choice: str) -> bool:
+    """Apply a vote and adjust the tallies; returns False if the user doesn't exist"""
+    if _vote_batcher is not None:
+        return _vote_batcher.submit(username, choice).result()
+
+    with prediction_tally.writing():
+        applied = upsert_votes(db, {username: choice})
+        if username not in applied:
+            return False
+        prediction_tally.apply(applied[username], choice)
+    return True
@@ -0,0 +1,336 @@
+"""
+Ingress rate limiting and load shedding (pure ASGI, runs before routing).
+
+Token buckets are kept per client IP and, where the route has a player in
+the path or query, per username. Budgets are per route (RATE_LIMITS) and
+scaled with RATE_LIMIT_MULTIPLIER. Rejections are answered directly from
+the middleware with 429 + Retry-After / X-RateLimit-* headers: no body
+parsing, no routing, no DB connection.
+
+Load shedding: when the event loop lags more than SHED_LOOP_LAG_MS or the
+primary DB pool is exhausted, /api requests get 503 + Retry-After instead
+of queueing behind work that is already late.
+
+Buckets live in each worker's memory (LRU, RATE_LIMIT_MAX_KEYS). With
+RATE_LIMIT_SHARED=1 on PostgreSQL, routes marked shared are also checked
+against a bucket row in rate_limit_buckets, updated with one atomic upsert,
+so the budget holds across workers. The shared check only runs for requests
+that passed the local bucket and fails open if the database errors.
+
+Behind nginx the TCP peer is the proxy, so the client address comes from
+X-Real-IP / X-Forwarded-For when the peer is in FORWARDED_ALLOW_IPS (the same
+setting gunicorn passes to uvicorn, which may already have resolved it). A
+proxied request from a peer that isn't trusted skips the per-IP bucket rather
+than putting every player into the proxy's one bucket.
+"""
+import asyncio
+import ipaddress
+import json
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+from urllib.parse import parse_qs, unquote
+
+from sqlalchemy import delete, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import SQLAlchemyError
+from starlette.concurrency import run_in_threadpool
+
+import metrics
+from database import DB_MAX_OVERFLOW, DB_POOL_SIZE, IS_SQLITE, engine
+from models import RateLimitBucket
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMIT_MULTIPLIER = float(os.getenv("RATE_LIMIT_MULTIPLIER", "1.0"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+RATE_LIMIT_SHARED = os.getenv("RATE_LIMIT_SHARED", "0") == "1"
+RATE_LIMIT_EXEMPT_IPS = {ip.strip() for ip in os.getenv("RATE_LIMIT_EXEMPT_IPS", "").split(",") if ip.strip()}
+SHED_LOOP_LAG_MS = float(os.getenv("SHED_LOOP_LAG_MS", "250"))  # 0 = disabled
+SHED_POOL_SATURATION = os.getenv("SHED_POOL_SATURATION", "1") == "1"
+# Comma-separated IPs or networks, "*" = any peer (same default as gunicorn)
+FORWARDED_ALLOW_IPS = [ip.strip() for ip in os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1").split(",") if ip.strip()]
+
+# First match wins:
+# (name, method or None, path prefix, per IP (tokens/s, burst), per username (tokens/s, burst), shared across workers)
+RATE_LIMITS = [
+    ("register", "POST", "/api/auth/register", (0.1, 5), None, True),
+    ("chat", "POST", "/api/chat/", (2.0, 10), (0.5, 5), True),
+    ("vote", "POST", "/api/predictions/vote", (1.0, 10), (0.2, 3), False),
+    ("api", None, "/api/", (10.0, 40), None, False),
+]
+
+LOOP_MONITOR_INTERVAL = 0.25
+SHARED_BUCKET_TTL = 3600  # rows idle longer than this are purged
+
+RATE_LIMITED = metrics.Counter("ratelimit_rejected_total", "Requests rejected with 429", ["rule", "scope"])
+LOAD_SHED = metrics.Counter("load_shed_total", "Requests rejected with 503 by load shedding", ["reason"])
+EVENT_LOOP_LAG = metrics.Gauge("event_loop_lag_seconds", "Event loop scheduling lag")
+BUCKETS = metrics.Gauge("ratelimit_buckets", "Token buckets held in memory")
+
+
+def _trusted_networks():
+    networks = []
+    for value in FORWARDED_ALLOW_IPS:
+        if value == "*":
+            return None
+        try:
+            networks.append(ipaddress.ip_network(value, strict=False))
+        except ValueError:
+            logger.warning("Ignoring invalid FORWARDED_ALLOW_IPS entry %r", value)
+    return networks
+
+
+TRUSTED_PROXIES = _trusted_networks()  # None = trust any peer
+
+
+def is_trusted_proxy(peer: str) -> bool:
+    if TRUSTED_PROXIES is None:
+        return True
+    try:
+        address = ipaddress.ip_address(peer)
+    except ValueError:
+        return False
+    return any(address in network for network in TRUSTED_PROXIES)
+
+
+def client_ip(scope) -> Optional[str]:
+    """Client address of the request; None when it is hidden behind a proxy that isn't trusted"""
+    client = scope.get("client")
+    peer = client[0] if client else ""
+    forwarded = None
+    for name, value in scope.get("headers", ()):
+        if name == b"x-real-ip":
+            forwarded = value.decode("latin-1").strip()
+            break
+        if name == b"x-forwarded-for":
+            # The rightmost entry was added by our proxy, the rest can be forged by the client
+            forwarded = value.decode("latin-1").rsplit(",", 1)[-1].strip()
+    if not forwarded or forwarded == peer:
+        # Direct request, or uvicorn already took the client from the headers
+        return peer
+    if is_trusted_proxy(peer):
+        return forwarded
+    return None
+
+
+def match_rule(method: str, path: str):
+    for rule in RATE_LIMITS:
+        name, rule_method, prefix = rule[:3]
+        if (rule_method is None or rule_method == method) and path.startswith(prefix):
+            return rule
+    return None
+
+
+def request_username(prefix: str, path: str, query_string: bytes) -> Optional[str]:
+    """Player from /prefix/{username} or ?username="""
+    if prefix.endswith("/") and len(path) > len(prefix):
+        return unquote(path[len(prefix):].split("/", 1)[0]) or None
+    if b"username=" in query_string:
+        return (parse_qs(query_string.decode("latin-1")).get("username") or [None])[0]
+    return None
+
+
+class TokenBuckets:
+    """LRU-bounded in-memory token buckets (event loop only, no locking)"""
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> [tokens, updated_at]
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, key: Tuple, rate: float, burst: float, now: float) -> Tuple[float, float]:
+        """Consume one token; returns (seconds to wait, 0 if allowed; tokens left)"""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = [burst, now]
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            self._buckets.move_to_end(key)
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0, bucket[0]
+        # Rejections don't consume, so a hammering client recovers at the refill rate
+        return (1 - bucket[0]) / rate, bucket[0]
+
+    def refund(self, key: Tuple, burst: float):
+        """Give back a token taken for a request that a later bucket rejected"""
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            bucket[0] = min(burst, bucket[0] + 1)
+
+
+def take_shared(key: str, rate: float, burst: float) -> float:
+    """Atomic refill-and-take on the shared bucket row; returns seconds to wait (0 if allowed)"""
+    table = RateLimitBucket.__table__
+    now = func.extract("epoch", func.clock_timestamp())
+    refilled = func.least(burst, table.c.tokens + (now - table.c.updated_at) * rate)
+    stmt = pg_insert(table).values(key=key, tokens=burst - 1, updated_at=now)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.key],
+        # Floor at -1: a rejected request costs at most one token of debt
+        set_={"tokens": func.greatest(refilled - 1, -1), "updated_at": now}
+    ).returning(table.c.tokens)
+    with engine.begin() as conn:
+        tokens = conn.execute(stmt).scalar()
+    return 0.0 if tokens >= 0 else -tokens / rate
+
+
+def refund_shared(key: str, burst: float):
+    table = RateLimitBucket.__table__
+    with engine.begin() as conn:
+        conn.execute(table.update().where(table.c.key == key).values(tokens=func.least(burst, table.c.tokens + 1)))
+
+
+def purge_shared_buckets():
+    table = RateLimitBucket.__table__
+    with engine.begin() as conn:
+        conn.execute(delete(table).where(
+            table.c.updated_at < func.extract("epoch", func.clock_timestamp()) - SHARED_BUCKET_TTL
+        ))
+
+
+class LoadMonitor:
+    """Tracks event loop lag from a periodic task and DB pool saturation"""
+
+    def __init__(self):
+        self.lag = 0.0
+        self._task = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        last_purge = loop.time()
+        while True:
+            scheduled = loop.time()
+            await asyncio.sleep(LOOP_MONITOR_INTERVAL)
+            lag = max(0.0, loop.time() - scheduled - LOOP_MONITOR_INTERVAL)
+            # Jump up immediately, decay slowly so shedding doesn't flap
+            self.lag = lag if lag > self.lag else self.lag * 0.5 + lag * 0.5
+            EVENT_LOOP_LAG.set(self.lag)
+
+            if shared_enabled() and loop.time() - last_purge > SHARED_BUCKET_TTL / 6:
+                last_purge = loop.time()
+                try:
+                    await run_in_threadpool(purge_shared_buckets)
+                except SQLAlchemyError as e:
+                    logger.warning("Rate limit bucket purge failed: %s", e)
+
+    def shed_reason(self) -> Optional[str]:
+        if SHED_LOOP_LAG_MS and self.lag * 1000 > SHED_LOOP_LAG_MS:
+            return "event_loop_lag"
+        # The SQLite writer is a single connection that is busy by design
+        if SHED_POOL_SATURATION and not IS_SQLITE and engine.pool.checkedout() >= DB_POOL_SIZE + DB_MAX_OVERFLOW:
+            return "db_pool_saturated"
+        return None
+
+
+def shared_enabled() -> bool:
+    return RATE_LIMIT_SHARED and engine.dialect.name == "postgresql"
+
+
+async def send_error(send, status_code: int, detail: str, headers: list):
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status_code,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            *headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class RateLimitMiddleware:
+    def __init__(self, app, buckets: TokenBuckets, monitor: LoadMonitor):
+        self.app = app
+        self.buckets = buckets
+        self.monitor = monitor
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+        rule = match_rule(scope["method"], scope["path"])
+        ip = client_ip(scope)
+        if rule is None or ip in RATE_LIMIT_EXEMPT_IPS:
+            await self.app(scope, receive, send)
+            return
+
+        reason = self.monitor.shed_reason()
+        if reason:
+            LOAD_SHED.inc(reason=reason)
+            await send_error(send, 503, "Server overloaded, retry shortly", [(b"retry-after", b"1")])
+            return
+
+        name, _, prefix, per_ip, per_user, shared = rule
+        checks = [("ip", ip, per_ip)] if ip is not None else []
+        if per_user:
+            username = request_username(prefix, scope["path"], scope.get("query_string", b""))
+            if username:
+                checks.append(("user", username, per_user))
+
+        now = time.monotonic()
+        taken = []  # (local key, shared key or None, burst) of the buckets that admitted the request
+        for scope_name, key, (rate, burst) in checks:
+            rate, burst = rate * RATE_LIMIT_MULTIPLIER, burst * RATE_LIMIT_MULTIPLIER
+            local_key, shared_key = (name, scope_name, key), None
+            wait, _ = self.buckets.take(local_key, rate, burst, now)
+            if not wait and shared and shared_enabled():
+                try:
+                    wait = await run_in_threadpool(take_shared, f"{name}:{scope_name}:{key}", rate, burst)
+                    shared_key = f"{name}:{scope_name}:{key}"
+                except SQLAlchemyError as e:
+                    logger.warning("Shared rate limit check failed, allowing request: %s", e)
+                if wait:
+                    # Only the shared bucket rejected: the local token was taken
+                    self.buckets.refund(local_key, burst)
+            if not wait:
+                taken.append((local_key, shared_key, burst))
+            else:
+                # A player over their own budget must not drain the IP bucket others behind the same NAT share
+                for taken_key, taken_shared, taken_burst in taken:
+                    self.buckets.refund(taken_key, taken_burst)
+                    if taken_shared:
+                        try:
+                            await run_in_threadpool(refund_shared, taken_shared, taken_burst)
+                        except SQLAlchemyError as e:
+                            logger.warning("Shared rate limit refund failed: %s", e)
+                RATE_LIMITED.inc(rule=name, scope=scope_name)
+                retry_after = str(max(1, math.ceil(wait))).encode()
+                await send_error(send, 429, "Too many requests", [
+                    (b"retry-after", retry_after),
+                    (b"x-ratelimit-limit", str(int(burst)).encode()),
+                    (b"x-ratelimit-remaining", b"0"),
+                    (b"x-ratelimit-reset", retry_after),
+                ])
+                return
+
+        await self.app(scope, receive, send)
+
+
+def install(app):
+    """Add the limiter (call before CORSMiddleware so 429/503 carry CORS headers)"""
+    if not RATE_LIMIT_ENABLED:
+        return
+    buckets = TokenBuckets(RATE_LIMIT_MAX_KEYS)
+    monitor = LoadMonitor()
+    BUCKETS.set_function(lambda: len(buckets))
+    app.add_middleware(RateLimitMiddleware, buckets=buckets, monitor=monitor)
+    app.add_event_handler("startup", monitor.start)
@@ -0,0 +1,383 @@
+"""
+Offline replay scorer for tuning KEYWORDS, SPECIAL_COMMANDS and hint thresholds.
+
+Replays every stored user message through the scoring rules of game_logic.py
+without calling GameLogic.analyze_message row by row: messages are deduplicated,
+a substring-presence matrix (unique message x pattern) is built once with NumPy,
+and progress / hints for each configuration are computed with array operations.
+
+Usage:
+    python replay_scorer.py                                   # current game_logic.py config
+    python replay_scorer.py --candidate new_config.json       # diff current vs candidate
+    python replay_scorer.py --baseline a.json --candidate b.json
+    python replay_scorer.py --verify 2000                     # check against GameLogic
+
+Config files are JSON and override any subset of the current config:
+    {
+        "keywords": {"quantum": 25, "exploit": 5},
+        "special_commands": ["help", "status"],
+        "combo_bonuses": [[["quantum", "protocol"], 30]],
+        "max_gain_per_message": 40,
+        "hint_thresholds": [[20, 40], [40, null]],
+        "random_hint_min_attempts": 5,
+        "random_hint_every": 3
+    }
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from typing import Dict, List
+
+import numpy as np
+from sqlalchemy import create_engine, select
+
+import game_logic
+from game_logic import GameLogic
+from models import Message, Session as DBSession
+
+# Unique messages are matched in chunks, shortest first, so the fixed-width string array
+# (rows x longest text in the chunk) stays within CHUNK_CHARS characters
+CHUNK_SIZE = 50000
+CHUNK_CHARS = 8_000_000
+
+PROGRESS_BINS = [0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 95, 101]
+GAIN_BINS = [0, 1, 10, 20, 30, 40, 50, 100, np.iinfo(np.int64).max]
+ATTEMPT_BUCKETS = [1, 2, 3, 5, 10, 20, 50, 100]
+
+
+def current_config() -> Dict:
+    """Scoring config currently used by game_logic.py"""
+    return {
+        "keywords": dict(game_logic.KEYWORDS),
+        "special_commands": list(game_logic.SPECIAL_COMMANDS),
+        "combo_bonuses": [[list(words), bonus] for words, bonus in game_logic.COMBO_BONUSES],
+        "max_gain_per_message": game_logic.MAX_GAIN_PER_MESSAGE,
+        "hint_thresholds": [[low, high] for low, high, _ in game_logic.HINT_THRESHOLDS],
+        "random_hint_min_attempts": game_logic.RANDOM_HINT_MIN_ATTEMPTS,
+        "random_hint_every": game_logic.RANDOM_HINT_EVERY,
+    }
+
+
+def load_config(path: str = None) -> Dict:
+    """Current config with overrides from a JSON file"""
+    config = current_config()
+    if path:
+        with open(path, encoding="utf-8") as f:
+            overrides = json.load(f)
+        unknown = set(overrides) - set(config)
+        if unknown:
+            raise ValueError(f"Unknown config keys in {path}: {', '.join(sorted(unknown))}")
+        config.update(overrides)
+    return config
+
+
+# ============= LOADING =============
+
+class ReplayData:
+    """User messages in replay order (per user, by time) with their unique texts"""
+
+    def __init__(self, texts: List[str], user_ids: np.ndarray, session_ids: np.ndarray):
+        # Deduplicate: jailbreak prompts repeat a lot, so the matrix is built over unique texts
+        index = {}
+        inverse = np.fromiter(
+            (index.setdefault(text, len(index)) for text in texts),
+            dtype=np.int64,
+            count=len(texts),
+        )
+        self.unique_texts = list(index)
+        self.inverse = inverse
+        self.user_ids = user_ids
+        self.session_ids = session_ids
+        self.size = len(texts)
+
+        # attempts = 1-based position of the message among the user's messages
+        positions = np.arange(self.size, dtype=np.int64)
+        self.user_start = _group_starts(user_ids)
+        self.attempts = positions - np.maximum.accumulate(np.where(self.user_start, positions, 0)) + 1
+        self.session_start = _group_starts(session_ids) | self.user_start
+        self._presence = {}
+
+    def presence(self, patterns: List[str]) -> Dict[str, np.ndarray]:
+        """Per-row presence vector for each pattern (substring match, as in analyze_message)"""
+        missing = [p for p in dict.fromkeys(patterns) if p not in self._presence]
+        if missing:
+            matrix = np.zeros((len(self.unique_texts), len(missing)), dtype=bool)
+            for rows in _length_chunks(self.unique_texts):
+                chunk = np.array([self.unique_texts[i] for i in rows], dtype=np.str_)
+                for col, pattern in enumerate(missing):
+                    matrix[rows, col] = np.char.find(chunk, pattern) >= 0
+            for col, pattern in enumerate(missing):
+                self._presence[pattern] = matrix[:, col][self.inverse]
+        return {p: self._presence[p] for p in patterns}
+
+
+def _length_chunks(texts: List[str]):
+    """Index arrays over texts, grouped by length so one long paste doesn't widen every row"""
+    lengths = np.fromiter((len(text) for text in texts), dtype=np.int64, count=len(texts))
+    order = np.argsort(lengths, kind="stable")
+    lengths = np.maximum(lengths[order], 1)
+    start = 0
+    while start < len(order):
+        end = min(start + CHUNK_SIZE, len(order))
+        # Sorted by length, so the last row is the widest
+        while end - start > 1 and (end - start) * lengths[end - 1] > CHUNK_CHARS:
+            end = start + max(1, min(end - start - 1, CHUNK_CHARS // lengths[end - 1]))
+        yield order[start:end]
+        start = end
+
+
+def _group_starts(keys: np.ndarray) -> np.ndarray:
+    """True where a new group of equal consecutive keys starts"""
+    starts = np.ones(len(keys), dtype=bool)
+    if len(keys):
+        starts[1:] = keys[1:] != keys[:-1]
+    return starts
+
+
+def _grouped_cumsum(values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """Inclusive cumulative sum that restarts at every group start"""
+    total = np.cumsum(values)
+    before = np.where(starts, total - values, 0)
+    return total - np.maximum.accumulate(before)
+
+
+def load_messages(database_url: str = None, limit: int = None) -> ReplayData:
+    """Load all user messages ordered per user by time"""
+    if database_url:
+        engine = create_engine(database_url)
+    else:
+        from database import engine
+
+    query = (
+        select(Message.text, Message.session_id, DBSession.user_id)
+        .join(DBSession, Message.session_id == DBSession.id)
+        .where(Message.sender == "user")
+        .order_by(DBSession.user_id, Message.timestamp, Message.id)
+    )
+    if limit:
+        query = query.limit(limit)
+
+    texts, session_ids, user_ids = [], [], []
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=CHUNK_SIZE).execute(query)
+        for text, session_id, user_id in result:
+            texts.append(text.lower())
+            session_ids.append(session_id)
+            user_ids.append(user_id)
+
+    return ReplayData(
+        texts,
+        np.array(user_ids, dtype=np.int64),
+        np.array(session_ids, dtype=np.int64),
+    )
+
+
+# ============= SCORING =============
+
+def score(data: ReplayData, config: Dict) -> Dict[str, np.ndarray]:
+    """
+    Replays all messages with the given config and returns per-message arrays:
+    - gain: progress gain from analyze_message
+    - hint: hint kind (0 none, 1 command, 2.. keyword threshold index + 2, -1 random)
+    - progress: progress reported to the player
+    - cracked: message cracked NEO
+    """
+    secret_words = game_logic.SECRET_PHRASE.lower().strip().split()
+    keywords = list(config["keywords"].items())
+    commands = list(config["special_commands"])
+    combos = [(list(words), bonus) for words, bonus in config["combo_bonuses"]]
+
+    patterns = [game_logic.SECRET_PHRASE.lower().strip()] + secret_words + [k for k, _ in keywords] + commands
+    for words, _ in combos:
+        patterns.extend(words)
+    present = data.presence(patterns)
+
+    # Crack check: only the first solution message of a user goes through the crack path
+    solution = present[patterns[0]] | np.logical_and.reduce([present[w] for w in secret_words])
+    cracked = solution & (_grouped_cumsum(solution.astype(np.int64), data.user_start) == 1)
+
+    is_command = np.zeros(data.size, dtype=bool)
+    for cmd in commands:
+        is_command |= present[cmd]
+
+    gain = np.zeros(data.size, dtype=np.int64)
+    for keyword, points in keywords:
+        gain += present[keyword] * points
+    for words, bonus in combos:
+        gain += np.logical_and.reduce([present[w] for w in words]) * bonus
+    gain = np.minimum(gain, config["max_gain_per_message"])
+    gain[is_command] = 0
+
+    hint = np.zeros(data.size, dtype=np.int64)
+    for idx, (low, high) in reversed(list(enumerate(config["hint_thresholds"]))):
+        in_range = (gain > 0) & (gain >= low)
+        if high is not None:
+            in_range &= gain < high
+        hint[in_range] = idx + 2
+    every = config["random_hint_every"]
+    random_hint = (data.attempts > config["random_hint_min_attempts"]) & (data.attempts % every == 0) & (gain == 0)
+    hint[random_hint] = -1
+    hint[is_command] = 1
+    hint[cracked] = 0
+
+    # Session hint counter before the message (sessions end on crack)
+    hint_given = (hint != 0).astype(np.int64)
+    hints_before = _grouped_cumsum(hint_given, data.session_start) - hint_given
+
+    progress = np.minimum(data.attempts * 2 + hints_before * 5 + gain, 95)
+    progress[cracked] = 100
+
+    return {"gain": gain, "hint": hint, "progress": progress, "cracked": cracked}
+
+
+def summarize(data: ReplayData, result: Dict[str, np.ndarray], config: Dict) -> Dict:
+    """Distributions of progress, gain and hints for one config"""
+    total = max(data.size, 1)
+    hint = result["hint"]
+    progress = result["progress"]
+
+    hint_counts = {
+        "command": int(np.count_nonzero(hint == 1)),
+        "random": int(np.count_nonzero(hint == -1)),
+    }
+    for idx, (low, high) in enumerate(config["hint_thresholds"]):
+        hint_counts[f"keyword {low}-{'' if high is None else high}"] = int(np.count_nonzero(hint == idx + 2))
+
+    progress_hist, _ = np.histogram(progress, bins=PROGRESS_BINS)
+    gain_hist, _ = np.histogram(result["gain"], bins=GAIN_BINS)
+
+    # Progress curve: mean progress by attempt number bucket
+    bucket = np.searchsorted(ATTEMPT_BUCKETS, data.attempts, side="right") - 1
+    sums = np.bincount(bucket, weights=progress, minlength=len(ATTEMPT_BUCKETS))
+    counts = np.bincount(bucket, minlength=len(ATTEMPT_BUCKETS))
+    curve = {
+        f"attempt {ATTEMPT_BUCKETS[i]}+": round(float(sums[i] / counts[i]), 1)
+        for i in range(len(ATTEMPT_BUCKETS)) if counts[i]
+    }
+
+    return {
+        "messages": data.size,
+        "users": int(np.count_nonzero(data.user_start)),
+        "cracks": int(np.count_nonzero(result["cracked"])),
+        "hint_rate": round(float(np.count_nonzero(hint)) / total * 100, 2),
+        "hints": hint_counts,
+        "mean_progress": round(float(progress.mean()) if data.size else 0.0, 2),
+        "progress_histogram": {
+            f"{PROGRESS_BINS[i]}-{PROGRESS_BINS[i + 1] - 1}": int(progress_hist[i])
+            for i in range(len(progress_hist))
+        },
+        "gain_histogram": {
+            f"{GAIN_BINS[i]}+" if i == len(gain_hist) - 1 else f"{GAIN_BINS[i]}-{GAIN_BINS[i + 1] - 1}": int(gain_hist[i])
+            for i in range(len(gain_hist))
+        },
+        "progress_curve": curve,
+    }
+
+
+def diff(data: ReplayData, baseline: Dict[str, np.ndarray], candidate: Dict[str, np.ndarray]) -> Dict:
+    """Per-message differences between two replays"""
+    total = max(data.size, 1)
+    delta = candidate["progress"] - baseline["progress"]
+    changed = delta != 0
+    return {
+        "progress_changed": int(np.count_nonzero(changed)),
+        "progress_changed_pct": round(float(np.count_nonzero(changed)) / total * 100, 2),
+        "progress_up": int(np.count_nonzero(delta > 0)),
+        "progress_down": int(np.count_nonzero(delta < 0)),
+        "mean_delta": round(float(delta.mean()) if data.size else 0.0, 2),
+        "hints_gained": int(np.count_nonzero((baseline["hint"] == 0) & (candidate["hint"] != 0))),
+        "hints_lost": int(np.count_nonzero((baseline["hint"] != 0) & (candidate["hint"] == 0))),
+    }
+
+
+def verify(data: ReplayData, result: Dict[str, np.ndarray], samples: int) -> int:
+    """Compares vectorized gain/hints with GameLogic.analyze_message on random messages"""
+    rng = random.Random(0)
+    mismatches = 0
+    game = GameLogic()
+    for row in rng.sample(range(data.size), min(samples, data.size)):
+        if result["cracked"][row]:
+            continue
+        text = data.unique_texts[data.inverse[row]]
+        gain, hint_given, _ = game.analyze_message(text, int(data.attempts[row]))
+        if gain != result["gain"][row] or hint_given != bool(result["hint"][row]):
+            mismatches += 1
+            print(f"MISMATCH row={row} attempts={data.attempts[row]} text={text[:60]!r}: "
+                  f"expected gain={gain} hint={hint_given}, "
+                  f"got gain={result['gain'][row]} hint={result['hint'][row]}")
+    return mismatches
+
+
+# ============= REPORT =============
+
+def print_report(baseline: Dict, candidate: Dict = None, changes: Dict = None):
+    """Prints summaries side by side"""
+    def rows(summary, prefix=""):
+        for key, value in summary.items():
+            if isinstance(value, dict):
+                yield from rows(value, prefix=f"{prefix}{key}: ")
+            else:
+                yield f"{prefix}{key}", value
+
+    base_rows = dict(rows(baseline))
+    if candidate is None:
+        for key, value in base_rows.items():
+            print(f"{key:<40} {value:>12}")
+        return
+
+    cand_rows = dict(rows(candidate))
+    print(f"{'metric':<40} {'baseline':>12} {'candidate':>12} {'delta':>10}")
+    for key in dict.fromkeys(list(base_rows) + list(cand_rows)):
+        old, new = base_rows.get(key, 0), cand_rows.get(key, 0)
+        print(f"{key:<40} {old:>12} {new:>12} {round(new - old, 2):>+10}")
+    print()
+    for key, value in changes.items():
+        print(f"{key:<40} {value:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay stored messages through scoring configs")
+    parser.add_argument("--database-url", help="Database to read messages from (default: DATABASE_URL)")
+    parser.add_argument("--baseline", help="Baseline config JSON (default: current game_logic.py)")
+    parser.add_argument("--candidate", help="Candidate config JSON to diff against the baseline")
+    parser.add_argument("--limit", type=int, help="Only replay the first N messages")
+    parser.add_argument("--verify", type=int, default=0, help="Check N random messages against GameLogic")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    data = load_messages(args.database_url, args.limit)
+    loaded = time.perf_counter()
+
+    baseline_config = load_config(args.baseline)
+    baseline = score(data, baseline_config)
+    report = {"baseline": summarize(data, baseline, baseline_config)}
+
+    if args.candidate:
+        candidate_config = load_config(args.candidate)
+        candidate = score(data, candidate_config)
+        report["candidate"] = summarize(data, candidate, candidate_config)
+        report["diff"] = diff(data, baseline, candidate)
+    scored = time.perf_counter()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report["baseline"], report.get("candidate"), report.get("diff"))
+        print(f"\nLoaded {data.size} messages ({len(data.unique_texts)} unique) in {loaded - started:.2f}s, "
+              f"scored in {scored - loaded:.2f}s")
+
+    if args.verify:
+        if args.baseline:
+            print("--verify compares against game_logic.py, ignoring --baseline")
+            baseline = score(data, current_config())
+        mismatches = verify(data, baseline, args.verify)
+        print(f"Verified {min(args.verify, data.size)} messages: {mismatches} mismatches")
+        if mismatches:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Fast JSON path for the polled read endpoints.
+
+Endpoints build plain dicts from query tuples and encode them with orjson
+(same output as the default encoder for our types: naive datetimes as
+ISO 8601, floats as-is).
+
+PayloadCache keeps the encoded bytes (and a gzipped copy for larger
+payloads) of each endpoint/key together with the query rows they were built
+from. When a poll returns the same rows, the stored bytes are sent as they
+are: no dict building, no encoding, no compression. Each payload carries a
+strong ETag, so clients sending If-None-Match get an empty 304.
+
+The cache is bounded by entries and by PAYLOAD_CACHE_MAX_BYTES (body, gzip
+copy and the rows, estimated as another body): per-player history payloads
+grow with the conversation, so the entry count alone doesn't bound memory.
+"""
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+import orjson
+from fastapi import Request
+from fastapi.responses import Response
+
+import metrics
+
+PAYLOAD_CACHE_SIZE = int(os.getenv("PAYLOAD_CACHE_SIZE", "2000"))
+PAYLOAD_CACHE_MAX_BYTES = int(os.getenv("PAYLOAD_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+GZIP_MIN_BYTES = int(os.getenv("GZIP_MIN_BYTES", "1024"))
+
+CACHE_BYTES = metrics.Gauge("payload_cache_bytes", "Estimated memory held by the payload cache")
+
+
+class _Payload:
+    __slots__ = ("rows", "body", "gzipped", "etag", "size")
+
+    def __init__(self, rows, body: bytes):
+        self.rows = rows
+        self.body = body
+        self.gzipped = gzip.compress(body, compresslevel=6) if len(body) >= GZIP_MIN_BYTES else None
+        self.etag = '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+        self.size = 2 * len(body) + len(self.gzipped or b"")
+
+
+class PayloadCache:
+    """LRU of encoded payloads keyed by (endpoint, key), reused while the rows are unchanged"""
+
+    def __init__(self, max_entries: int, max_bytes: int = PAYLOAD_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._payloads = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, rows, build: Callable[[Any], Any]) -> _Payload:
+        with self._lock:
+            payload = self._payloads.get(key)
+            if payload is not None:
+                self._payloads.move_to_end(key)
+        hit = payload is not None and payload.rows == rows
+        metrics.record_cache("payload:" + str(key[0]), hit)
+        if hit:
+            return payload
+
+        payload = _Payload(rows, orjson.dumps(build(rows)))
+        with self._lock:
+            old = self._payloads.pop(key, None)
+            if old is not None:
+                self.bytes -= old.size
+            # A payload taking over a quarter of the budget would evict most of the cache: send it uncached
+            if payload.size <= self.max_bytes // 4:
+                self._payloads[key] = payload
+                self.bytes += payload.size
+            while self._payloads and (len(self._payloads) > self.max_entries or self.bytes > self.max_bytes):
+                _, evicted = self._payloads.popitem(last=False)
+                self.bytes -= evicted.size
+        return payload
+
+
+payload_cache = PayloadCache(PAYLOAD_CACHE_SIZE)
+CACHE_BYTES.set_function(lambda: payload_cache.bytes)
+
+
+def cached_json(request: Request, key: Hashable, rows, build: Callable[[Any], Any]) -> Response:
+    """
+    JSON response for rows (a tuple of query result tuples), built with build(rows)
+    only when the rows differ from the cached payload for key.
+    """
+    payload = payload_cache.get(key, rows, build)
+    use_gzip = payload.gzipped is not None and "gzip" in request.headers.get("accept-encoding", "")
+    # Each encoding is its own representation with its own ETag
+    etag = payload.etag[:-1] + '-gzip"' if use_gzip else payload.etag
+    headers = {"ETag": etag, "Vary": "Accept-Encoding"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+        return Response(payload.gzipped, media_type="application/json", headers=headers)
+    return Response(payload.body, media_type="application/json", headers=headers)
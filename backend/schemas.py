@@ -43,6 +43,10 @@ class SessionResponse(BaseModel):
     started_at: datetime
     messages_count: int
     hints_given: int
+    peak_progress: int = 0
+    ended_at: Optional[datetime] = None  # None while the session is open
+    duration_seconds: Optional[int] = None
+    cracked: bool = False
     
     class Config:
         from_attributes = True
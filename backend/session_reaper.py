@@ -0,0 +1,179 @@
+"""
+Idle session reaper: closes sessions without activity for SESSION_IDLE_MINUTES
+and rolls each closed session up into a session_summaries row (duration,
+message count, peak progress, hints).
+
+Only open sessions are indexed by user (ix_sessions_user_active), so closing
+idle ones keeps the per-message active-session lookup small; /api/sessions
+reads the summaries plus the open session. A closed session ends at its last
+activity. Closing is one UPDATE ... RETURNING per batch, and the summaries are
+inserted in the same transaction.
+
+Every worker runs a reaper thread every SESSION_REAP_INTERVAL_SECONDS. The
+ended_at IS NULL condition is re-checked under the row lock, so concurrent
+passes close (and summarize) each session once.
+"""
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import List
+
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import metrics
+from database import SessionLocal
+from models import Message, Session as DBSession, SessionSummary
+
+logger = logging.getLogger(__name__)
+
+SESSION_IDLE_MINUTES = float(os.getenv("SESSION_IDLE_MINUTES", "30"))
+SESSION_REAP_INTERVAL_SECONDS = float(os.getenv("SESSION_REAP_INTERVAL_SECONDS", "60"))  # 0 = disabled
+SESSION_REAP_BATCH = int(os.getenv("SESSION_REAP_BATCH", "500"))
+
+SESSIONS_CLOSED = metrics.Counter("sessions_closed_total", "Sessions closed and summarized", ["reason"])
+
+_SUMMARY_COLUMNS = (
+    DBSession.id, DBSession.user_id, DBSession.started_at, DBSession.ended_at,
+    DBSession.messages_count, DBSession.hints_given, DBSession.peak_progress,
+)
+
+
+def idle_cutoff(now: datetime = None) -> datetime:
+    return (now or datetime.utcnow()) - timedelta(minutes=SESSION_IDLE_MINUTES)
+
+
+def is_idle(session: DBSession, now: datetime = None) -> bool:
+    return (session.last_activity_at or session.started_at) < idle_cutoff(now)
+
+
+def _insert_summaries(db: Session, rows, cracked: bool) -> int:
+    summaries = [{
+        "session_id": session_id,
+        "user_id": user_id,
+        "started_at": started_at,
+        "ended_at": ended_at,
+        "duration_seconds": max(0, int((ended_at - started_at).total_seconds())),
+        "messages_count": messages_count or 0,
+        "hints_given": hints_given or 0,
+        "peak_progress": peak_progress or 0,
+        "cracked": cracked,
+    } for session_id, user_id, started_at, ended_at, messages_count, hints_given, peak_progress in rows]
+    if summaries:
+        db.execute(SessionSummary.__table__.insert(), summaries)
+    return len(summaries)
+
+
+def close_sessions(db: Session, where: List, limit: int, reason: str) -> int:
+    """Close up to limit open sessions matching where and insert their summaries (caller commits)"""
+    ids = select(DBSession.id).where(DBSession.ended_at.is_(None), *where).limit(limit)
+    rows = db.execute(
+        update(DBSession)
+        .where(DBSession.id.in_(ids), DBSession.ended_at.is_(None))
+        .values(ended_at=func.coalesce(DBSession.last_activity_at, DBSession.started_at))
+        .returning(*_SUMMARY_COLUMNS)
+        .execution_options(synchronize_session=False)
+    ).all()
+    closed = _insert_summaries(db, rows, cracked=False)
+    if closed:
+        SESSIONS_CLOSED.inc(closed, reason=reason)
+    return closed
+
+
+def summarize_ended(db: Session, where: List, limit: int, cracked: bool) -> int:
+    """Insert summaries for up to limit ended sessions that have none (caller commits)"""
+    rows = db.execute(
+        select(*_SUMMARY_COLUMNS)
+        .outerjoin(SessionSummary, SessionSummary.session_id == DBSession.id)
+        .where(DBSession.ended_at.is_not(None), SessionSummary.id.is_(None), *where)
+        .limit(limit)
+    ).all()
+    return _insert_summaries(db, rows, cracked)
+
+
+def summarize_cracked_session(db: Session, session: DBSession):
+    """Insert the summary of a session the crack just ended (caller commits)"""
+    # The victory reply is recorded after the response: count it and its progress here
+    _insert_summaries(db, [(
+        session.id, session.user_id, session.started_at, session.ended_at,
+        (session.messages_count or 0) + 1, session.hints_given, 100,
+    )], cracked=True)
+    SESSIONS_CLOSED.inc(reason="crack")
+
+
+def reap_idle_sessions() -> int:
+    """Close every session idle past the cutoff, one transaction per batch"""
+    total = 0
+    while True:
+        db = SessionLocal()
+        try:
+            last_activity = func.coalesce(DBSession.last_activity_at, DBSession.started_at)
+            closed = close_sessions(db, [last_activity < idle_cutoff()], SESSION_REAP_BATCH, "idle")
+            db.commit()
+        finally:
+            db.close()
+        total += closed
+        if closed < SESSION_REAP_BATCH:
+            return total
+
+
+def backfill():
+    """Bring sessions from before the reaper up to date (init_db runs it before serving)"""
+    db = SessionLocal()
+    try:
+        # Open sessions: last activity is the latest message
+        latest_message = select(func.max(Message.timestamp)).where(
+            Message.session_id == DBSession.id
+        ).scalar_subquery()
+        db.execute(
+            update(DBSession)
+            .where(DBSession.ended_at.is_(None), DBSession.last_activity_at.is_(None))
+            .values(last_activity_at=func.coalesce(latest_message, DBSession.started_at))
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+
+        # Closed sessions without a summary: before the reaper, sessions were only closed on a crack
+        while True:
+            try:
+                if not summarize_ended(db, [], SESSION_REAP_BATCH, cracked=True):
+                    break
+                db.commit()
+            except IntegrityError:
+                # Another worker summarized some of the batch first
+                db.rollback()
+    finally:
+        db.close()
+
+
+class SessionReaper:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._pid = None
+        self._stop = threading.Event()
+
+    def start(self):
+        # Threads don't survive gunicorn's fork: start in each worker
+        if not self.interval or self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._stop.clear()
+        threading.Thread(target=self._run, name="session-reaper", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                closed = reap_idle_sessions()
+                if closed:
+                    logger.info("Closed %d idle sessions", closed)
+            except Exception as e:
+                logger.warning("Session reaper pass failed: %s", e)
+            self._stop.wait(self.interval)
+
+
+session_reaper = SessionReaper(SESSION_REAP_INTERVAL_SECONDS)
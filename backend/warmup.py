@@ -0,0 +1,66 @@
+"""
+Worker warmup: runs at startup before the worker accepts requests.
+
+Creates the schema (unless the gunicorn master already did), opens the DB
+pool connections, primes in-memory caches and pre-connects to the LLM API,
+so the first request a worker serves pays no cold-start cost.
+"""
+import logging
+import os
+import time
+
+from sqlalchemy import text
+
+from ai_service import get_deepseek_service
+from database import SessionLocal, engine, init_db, replica_engine
+from models import User
+from predictions import prediction_tally
+
+logger = logging.getLogger(__name__)
+
+# Readiness state reported by /ready
+state = {"ready": False, "error": None, "warmup_seconds": None}
+
+
+def warm_pool(db_engine):
+    """Open pool_size connections and return them to the pool"""
+    connections = []
+    try:
+        for _ in range(db_engine.pool.size()):
+            conn = db_engine.connect()
+            conn.execute(text("SELECT 1"))
+            connections.append(conn)
+    finally:
+        for conn in connections:
+            conn.close()
+
+
+def prime_caches():
+    """Load in-memory state and compile the hottest queries"""
+    db = SessionLocal()
+    try:
+        prediction_tally.load(db)
+        db.query(User).filter(User.username == "").first()
+    finally:
+        db.close()
+
+
+def warm_up():
+    started = time.perf_counter()
+    try:
+        if os.getenv("SKIP_SCHEMA_INIT") != "1":
+            init_db()
+        warm_pool(engine)
+        if replica_engine is not None:
+            warm_pool(replica_engine)
+        prime_caches()
+        get_deepseek_service().warm_up()
+    except Exception as e:
+        state["error"] = str(e)
+        logger.error("Warmup failed: %s", e)
+        return
+
+    state["ready"] = True
+    state["error"] = None
+    state["warmup_seconds"] = round(time.perf_counter() - started, 3)
+    logger.info("Worker %d warm in %ss", os.getpid(), state["warmup_seconds"])
@@ -60,6 +60,23 @@ function hideTyping(){const e=document.getElementById('typing');if(e)e.remove()}
 let currentProgress=0;
 let isCracked=false;
 
+// Один ключ на сообщение: повтор после обрыва связи не засчитывается бэкендом дважды
+function newIdempotencyKey(){
+  return window.crypto&&crypto.randomUUID?crypto.randomUUID():Date.now()+'-'+Math.random().toString(36).slice(2);
+}
+
+async function postWithRetry(url,body,retries=2){
+  const headers={'Content-Type':'application/json','Idempotency-Key':newIdempotencyKey()};
+  for(let attempt=0;;attempt++){
+    try{
+      return await fetch(url,{method:'POST',headers,body:JSON.stringify(body)});
+    }catch(err){
+      if(attempt>=retries)throw err;
+      await new Promise(r=>setTimeout(r,500*(attempt+1)));
+    }
+  }
+}
+
 async function send(){
   const t=inp.value.trim();
   if(!t||isCracked)return;
@@ -71,11 +88,7 @@ async function send(){
   showTyping();
   
   try{
-    const res=await fetch(`${API_URL}/api/chat/${user}`,{
-      method:'POST',
-      headers:{'Content-Type':'application/json'},
-      body:JSON.stringify({text:t})
-    });
+    const res=await postWithRetry(`${API_URL}/api/chat/${user}`,{text:t});
     
     if(!res.ok)throw new Error('API request failed');
     
@@ -187,11 +200,7 @@ function vote(choice){
   if(hasVoted) return;
 
   // Send vote to backend
-  fetch(`${API_URL}/api/predictions/vote?username=${user}`, {
-    method: 'POST',
-    headers: { 'Content-Type': 'application/json' },
-    body: JSON.stringify({ choice: choice })
-  })
+  postWithRetry(`${API_URL}/api/predictions/vote?username=${user}`, { choice: choice })
   .then(res => res.json())
   .then(data => {
     hasVoted = true;